@@ -0,0 +1,119 @@
+import datetime
+import json
+import zlib
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Conversation, Message, MessageArchiveBlock
+
+
+def message_key(message):
+    return (message.timestamp, message.id)
+
+
+def encode_block(rows):
+    """rows: (id, sender_id, receiver_id, timestamp, is_read, message, seq) tuples, oldest first."""
+    payload = [
+        [message_id, sender_id, receiver_id, timestamp.isoformat(), is_read, text, seq]
+        for message_id, sender_id, receiver_id, timestamp, is_read, text, seq in rows
+    ]
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode(), 6)
+
+
+def decode_block(data):
+    """Unsaved Message instances, oldest first."""
+    return [
+        Message(
+            id=message_id,
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            timestamp=datetime.datetime.fromisoformat(timestamp),
+            is_read=is_read,
+            message=text,
+            # Blocks written before sequence numbers existed have no seq
+            seq=rest[0] if rest else None,
+        )
+        for message_id, sender_id, receiver_id, timestamp, is_read, text, *rest in json.loads(
+            zlib.decompress(bytes(data))
+        )
+    ]
+
+
+def archive_conversation(conversation, cutoff, block_size):
+    """
+    Move this conversation's read messages older than `cutoff` into
+    archive blocks of up to `block_size` messages. Returns how many moved.
+
+    Unread messages stay hot so read receipts keep working on them, and so
+    does the conversation's last message, which the sidebar shows.
+    """
+    candidates = (
+        Message.objects.filter(
+            (Q(sender_id=conversation.user_a_id) & Q(receiver_id=conversation.user_b_id)) |
+            (Q(sender_id=conversation.user_b_id) & Q(receiver_id=conversation.user_a_id)),
+            timestamp__lt=cutoff,
+            is_read=True,
+        )
+        .exclude(id=conversation.last_message_id)
+        .order_by("timestamp", "id")
+        .values_list("id", "sender_id", "receiver_id", "timestamp", "is_read", "message", "seq")
+    )
+
+    moved = 0
+    while True:
+        rows = list(candidates[:block_size])
+        if not rows:
+            return moved
+
+        with transaction.atomic():
+            first, last = rows[0], rows[-1]
+            MessageArchiveBlock.objects.create(
+                conversation=conversation,
+                first_timestamp=first[3],
+                first_id=first[0],
+                last_timestamp=last[3],
+                last_id=last[0],
+                message_count=len(rows),
+                data=encode_block(rows),
+            )
+            Message.objects.filter(id__in=[row[0] for row in rows]).delete()
+        moved += len(rows)
+
+
+def archived_before(user_id, other_user_id, before=None, after=None, limit=50):
+    """
+    Newest `limit` archived messages of the pair, newest first, with
+    (timestamp, id) keys strictly between `after` and `before`.
+
+    Blocks are visited newest first and only decompressed while one could
+    still contain a message in the top `limit`.
+    """
+    a, b = Conversation.pair_ids(user_id, other_user_id)
+    blocks = MessageArchiveBlock.objects.filter(
+        conversation__user_a_id=a, conversation__user_b_id=b
+    )
+    if before is not None:
+        blocks = blocks.filter(
+            Q(first_timestamp__lt=before[0]) | Q(first_timestamp=before[0], first_id__lt=before[1])
+        )
+    if after is not None:
+        blocks = blocks.filter(
+            Q(last_timestamp__gt=after[0]) | Q(last_timestamp=after[0], last_id__gt=after[1])
+        )
+
+    rows = []
+    for last_timestamp, last_id, data in (
+        blocks.order_by("-last_timestamp", "-last_id")
+        .values_list("last_timestamp", "last_id", "data")
+        .iterator(chunk_size=4)
+    ):
+        if len(rows) >= limit and (last_timestamp, last_id) < message_key(rows[limit - 1]):
+            break
+        for message in decode_block(data):
+            key = message_key(message)
+            if (before is None or key < before) and (after is None or key > after):
+                rows.append(message)
+        rows.sort(key=message_key, reverse=True)
+        del rows[limit:]
+    return rows
@@ -1,15 +1,545 @@
-import json
+import asyncio
+import logging
+from contextlib import nullcontext
+from urllib.parse import parse_qs
 
+from channels.exceptions import ChannelFull, StopConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-
-from .models import Message
+from django.db import IntegrityError, transaction
+
+from chat_app.metrics import (
+    CHANNEL_FULL_DROPS,
+    CHAT_MESSAGES,
+    FRAMES_THROTTLED,
+    GROUP_SEND_LATENCY,
+    OUTBOX_DROPPED,
+    SLOW_CLIENT_CLOSES,
+    WS_HANDLER_LATENCY,
+    WS_OPEN,
+    metrics_enabled,
+)
+from users.cache import user_cache
+
+from .db import DatabaseBusy, database_sync_to_async
+from .delivery import INBOX, get_delivery_registry
+from .history import RESUME_BATCH_SIZE, conversation_messages
+from .models import Conversation, Message
+from .persistence import get_buffer, write_behind_enabled
+from .presence import get_presence, presence_group
+from .protocol import negotiate
+from .receipts import ReadReceiptBatcher
+from .throttle import FrameLimiter
+from .typing import TypingTracker
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+def room_group_name(user1_id, user2_id):
+    # Unique room name for two users
+    user_ids = sorted([user1_id, user2_id])
+    return f"chat_group_chat_{user_ids[0]}_{user_ids[1]}"
+
+
+def inbox_group_name(user_id):
+    return f"inbox_{user_id}"
+
+
+class ChatEventsMixin:
+    """
+    Sending and receiving chat events, shared by the per-room ChatConsumer
+    and the per-user InboxConsumer so both see the same traffic.
+    """
+
+    # Most events packed into one frame for batching codecs
+    MAX_BATCH = 64
+
+    # What a client that can't keep up loses before it gets disconnected
+    EPHEMERAL_EVENTS = frozenset({"typing", "user_status"})
+
+    # Close code for sockets whose outbox overflowed
+    CLOSE_TOO_SLOW = 4008
+
+    def timed(self, handler):
+        if not metrics_enabled():
+            return nullcontext()
+        return WS_HANDLER_LATENCY.time(type(self).__name__, handler)
+
+    async def websocket_connect(self, message):
+        with self.timed("connect"):
+            await super().websocket_connect(message)
+
+    async def websocket_receive(self, message):
+        with self.timed("receive"):
+            try:
+                await super().websocket_receive(message)
+            except DatabaseBusy:
+                # Shed the frame; the client may retry it (client_id dedups
+                # sends), so tell it which one
+                try:
+                    client_id = self.decode(message.get("text"), message.get("bytes")).get("client_id")
+                except Exception:
+                    client_id = None
+                await self.send_event({
+                    "type": "error",
+                    "error": "Server busy, try again.",
+                    "client_id": self.idempotency_key(client_id),
+                    "retry_after": settings.CHAT_DB_QUEUE_TIMEOUT,
+                })
+
+    async def websocket_disconnect(self, message):
+        with self.timed("disconnect"):
+            await self.release(message["code"])
+        raise StopConsumer()
+
+    async def dispatch(self, message):
+        try:
+            await super().dispatch(message)
+        except StopConsumer:
+            raise
+        except Exception:
+            # The socket dies with the exception and websocket_disconnect
+            # never comes, so give back what connect() took here
+            await self.release(1011)
+            raise
+
+    async def release(self, close_code):
+        """Run the disconnect cleanup exactly once."""
+        if getattr(self, "released", False):
+            return
+        self.released = True
+        if getattr(self, "counted_open", False):
+            WS_OPEN.dec(type(self).__name__)
+            self.counted_open = False
+        await self.disconnect(close_code)
+
+    async def group_send(self, group, event):
+        with GROUP_SEND_LATENCY.time() if metrics_enabled() else nullcontext():
+            await self.channel_layer.group_send(group, event)
+
+    async def accept_negotiated(self):
+        self.codec = negotiate(self.scope)
+        self.outbox = []
+        self.flusher = None
+        self.outbox_limit = settings.CHAT_OUTBOX_LIMIT
+        self.too_slow = False
+        self.limiter = FrameLimiter(self.user.id)
+
+        # The server's send() only buffers (daphne hands frames to Twisted
+        # and returns), so a slow reader is only visible through its acks.
+        # Clients that connect with ?ack=1 report the frames they have
+        # received; at send_window unacknowledged frames the flusher waits
+        # and events queue in the outbox, where the drop/close policy applies.
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.acks = query.get("ack", [""])[0] == "1"
+        self.send_window = settings.CHAT_SEND_WINDOW
+        self.frames_sent = 0
+        self.frames_acked = 0
+        self.window_open = asyncio.Event()
+
+        subprotocol = None
+        if self.codec.subprotocol in self.scope.get("subprotocols", []):
+            subprotocol = self.codec.subprotocol
+        await self.accept(subprotocol=subprotocol)
+        if metrics_enabled():
+            WS_OPEN.inc(type(self).__name__)
+            self.counted_open = True
+
+    def decode(self, text_data=None, bytes_data=None):
+        """The frame as a dict; ValueError if it isn't an event."""
+        try:
+            data = self.codec.decode(text_data=text_data, bytes_data=bytes_data)
+        except Exception:
+            raise ValueError("Invalid frame.")
+        if not isinstance(data, dict) or not isinstance(data.get("type", ""), str):
+            raise ValueError("Invalid frame.")
+        return data
+
+    async def throttled(self, message_type, data):
+        """Refuse a frame over its rate limit; True if it was refused."""
+        if message_type == "typing" and not data.get("is_typing"):
+            # Always let a stop through, or the indicator hangs until it times out
+            return False
+        refused = self.limiter.check(message_type)
+        if refused is None:
+            return False
+
+        scope, retry_after = refused
+        if metrics_enabled():
+            FRAMES_THROTTLED.inc(message_type, scope)
+        if message_type == "chat_message":
+            await self.send_event({
+                "type": "error",
+                "error": "Sending too fast, try again shortly.",
+                "client_id": data.get("client_id"),
+                "retry_after": round(retry_after, 3),
+            })
+        return True
+
+    async def send_event(self, event):
+        if self.too_slow:
+            return
+
+        # Events that pile up while a send is in flight go out together
+        # (batching codecs) or back to back, up to outbox_limit of them
+        if len(self.outbox) >= self.outbox_limit:
+            if event["type"] in self.EPHEMERAL_EVENTS:
+                dropped = event
+            else:
+                dropped = next((e for e in self.outbox if e["type"] in self.EPHEMERAL_EVENTS), None)
+                if dropped is None:
+                    await self.close_too_slow()
+                    return
+                self.outbox.remove(dropped)
+            if metrics_enabled():
+                OUTBOX_DROPPED.inc(dropped["type"])
+            if dropped is event:
+                return
+
+        self.outbox.append(event)
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self.flush_outbox())
+
+    async def close_too_slow(self):
+        logger.info("Closing %s: %d events behind", self.channel_name, len(self.outbox))
+        if metrics_enabled():
+            SLOW_CLIENT_CLOSES.inc(type(self).__name__)
+        self.too_slow = True
+        self.stop_outbox()
+        self.outbox.clear()
+        await self.close(code=self.CLOSE_TOO_SLOW)
+
+    async def flush_outbox(self):
+        try:
+            while self.outbox:
+                while self.acks and self.frames_sent - self.frames_acked >= self.send_window:
+                    self.window_open.clear()
+                    await self.window_open.wait()
+                batch = self.outbox[:self.MAX_BATCH]
+                del self.outbox[:self.MAX_BATCH]
+                for frame in self.codec.encode(batch):
+                    await self.send(**frame)
+                    self.frames_sent += 1
+        finally:
+            self.flusher = None
+
+    def acknowledge(self, data):
+        """An "ack" frame: the client has received `frames` frames so far."""
+        try:
+            frames = int(data.get("frames"))
+        except (TypeError, ValueError):
+            return
+        if self.frames_acked < frames <= self.frames_sent:
+            self.frames_acked = frames
+            self.window_open.set()
+
+    def stop_outbox(self):
+        if getattr(self, "flusher", None) is not None:
+            self.flusher.cancel()
+
+    async def register_channel(self, label):
+        self.delivery_registry = get_delivery_registry()
+        if self.delivery_registry is not None:
+            try:
+                await self.delivery_registry.register(self.user.id, self.channel_name, label)
+            except Exception:
+                logger.warning("Could not register %s for direct delivery", self.channel_name, exc_info=True)
+
+    async def unregister_channel(self):
+        if getattr(self, "delivery_registry", None) is not None:
+            try:
+                await self.delivery_registry.unregister(self.user.id, self.channel_name)
+            except Exception:
+                logger.warning("Could not unregister %s", self.channel_name, exc_info=True)
+
+    async def fanout(self, event, other_user_id, inbox_user_ids):
+        """
+        Send to the room sockets of this pair and the inbox sockets of
+        `inbox_user_ids`: straight to their channels when the delivery
+        registry knows them, through the channel-layer groups otherwise.
+        """
+        room = room_group_name(self.user.id, other_user_id)
+        inbox_user_ids = list(dict.fromkeys(inbox_user_ids))
+
+        registry = getattr(self, "delivery_registry", None)
+        if registry is not None:
+            targets = [(user_id, room) for user_id in dict.fromkeys([self.user.id, other_user_id])]
+            targets += [(user_id, INBOX) for user_id in inbox_user_ids]
+            try:
+                channels = await registry.channels(targets)
+            except Exception:
+                logger.warning("Delivery registry unavailable, using groups", exc_info=True)
+                channels = None
+            if channels is not None:
+                # Independent sends: one round trip's wait for all of them
+                results = await asyncio.gather(
+                    *(self.channel_layer.send(channel_name, event) for channel_name in channels),
+                    return_exceptions=True,
+                )
+                for channel_name, result in zip(channels, results):
+                    if isinstance(result, ChannelFull):
+                        # Like group_send: a backed-up recipient loses the
+                        # event, the sender's socket is unaffected
+                        logger.info("Dropped %s for full channel %s", event["type"], channel_name)
+                        if metrics_enabled():
+                            CHANNEL_FULL_DROPS.inc()
+                    elif isinstance(result, BaseException):
+                        raise result
+                return
+
+        for group in [room, *(inbox_group_name(user_id) for user_id in inbox_user_ids)]:
+            await self.group_send(group, event)
+
+    async def deliver(self, other_user_id, event):
+        # Legacy room sockets plus every inbox socket of both participants
+        await self.fanout(event, other_user_id, [self.user.id, other_user_id])
+
+    async def send_chat_message(self, other_user, conversation_id, message, client_id=None):
+        client_id = self.idempotency_key(client_id)
+        event = {
+            "type": "chat.message",
+            "conversation": conversation_id,
+            "message": message,
+            "sender": self.user.username,
+            "client_id": client_id,
+            "id": None,
+            "seq": None,
+        }
+        if metrics_enabled():
+            CHAT_MESSAGES.inc(settings.CHAT_PERSISTENCE)
+
+        if write_behind_enabled():
+            # Broadcast now, persist in the next batch
+            await self.deliver(other_user.id, event)
+            await get_buffer().enqueue(
+                self.user.id,
+                other_user.id,
+                message,
+                reply_channel=self.channel_name,
+                client_id=client_id,
+            )
+            return
+
+        # Save message; a retry of a stored send is only acknowledged again
+        msg, created = await self.save_message(self.user, other_user, message, client_id)
+
+        if created:
+            event["id"] = msg.id
+            event["seq"] = msg.seq
+            await self.deliver(other_user.id, event)
+
+        # Queued behind the broadcast so the ack follows the echo
+        await self.channel_layer.send(
+            self.channel_name,
+            {
+                "type": "message.persisted",
+                "id": msg.id,
+                "client_id": client_id,
+                "seq": msg.seq,
+            },
+        )
+
+    async def send_resume(self, other_user, conversation_id, last_seq):
+        """Everything after `last_seq` in one frame, for a reconnecting client."""
+        if write_behind_enabled():
+            # Messages broadcast while the client was away may still be queued
+            await get_buffer().flush()
+
+        messages, has_more, current = await self.missed_messages(other_user, last_seq)
+        await self.send_event({
+            "type": "resume",
+            "conversation": conversation_id,
+            "messages": [
+                {
+                    "id": msg.id,
+                    "seq": msg.seq,
+                    "message": msg.message,
+                    "sender": msg.sender.username,
+                    "client_id": msg.client_id,
+                    "timestamp": msg.timestamp.isoformat(),
+                    "is_read": msg.is_read,
+                }
+                for msg in messages
+            ],
+            "has_more": has_more,
+            "last_seq": current,
+        })
+
+    async def send_typing(self, other_user, conversation_id, is_typing):
+        # Keystroke frames are coalesced; only transitions and periodic
+        # refreshes reach the channel layer
+        is_typing = bool(is_typing)
+        if self.typing.update(conversation_id, is_typing, other_user, conversation_id, False):
+            await self.broadcast_typing(other_user, conversation_id, is_typing)
+
+    async def broadcast_typing(self, other_user, conversation_id, is_typing):
+        event = {
+            "type": "chat.typing",
+            "conversation": conversation_id,
+            "is_typing": is_typing,
+            "sender": self.user.username,
+        }
+        inboxes = [other_user.id] if other_user.id != self.user.id else []
+        await self.fanout(event, other_user.id, inboxes)
+
+    async def send_read(self, other_user, conversation_id, up_to=None):
+        # Coalesced per conversation; apply_read runs once per window
+        self.receipts.add(conversation_id, other_user, up_to)
+
+    async def apply_read(self, other_user, conversation_id, up_to):
+        updated = await self.mark_read(other_user, up_to)
+        if not updated:
+            return
+        await self.deliver(
+            other_user.id,
+            {
+                "type": "chat.read",
+                "conversation": conversation_id,
+                "reader": self.user.username,
+                "up_to": up_to,
+            },
+        )
+
+    async def chat_message(self, event):
+        await self.send_event({
+            "type": "chat_message",
+            "conversation": event.get("conversation"),
+            "message": event["message"],
+            "sender": event["sender"],
+            "client_id": event.get("client_id"),
+            "id": event.get("id"),
+            "seq": event.get("seq"),
+        })
+
+    async def chat_typing(self, event):
+        await self.send_event({
+            "type": "typing",
+            "conversation": event.get("conversation"),
+            "is_typing": event["is_typing"],
+            "sender": event["sender"],
+        })
+
+    async def chat_read(self, event):
+        await self.send_event({
+            "type": "read",
+            "conversation": event["conversation"],
+            "reader": event["reader"],
+            "up_to": event.get("up_to"),
+        })
+
+    async def message_persisted(self, event):
+        await self.send_event({
+            "type": "persisted",
+            "id": event["id"],
+            "client_id": event["client_id"],
+            "seq": event.get("seq"),
+        })
+
+    async def user_status(self, event):
+        await self.send_event({
+            "type": "user_status",
+            "username": event["username"],
+            "is_online": event["is_online"],
+        })
+
+    @database_sync_to_async
+    def get_user(self, username):
+        user = user_cache.get_by_username(username)
+        if user is None:
+            raise User.DoesNotExist(username)
+        return user
+
+    @database_sync_to_async
+    def get_conversation_id(self, other_user):
+        return Conversation.for_users(self.user.id, other_user.id).id
+
+    @database_sync_to_async(shed=False)
+    def mark_read(self, other_user, up_to=None):
+        return Conversation.mark_read(self.user.id, other_user.id, up_to)
+
+    @staticmethod
+    def message_text(data):
+        """A chat_message frame's text; ValueError unless it is a non-empty string."""
+        message = data.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise ValueError("Invalid message.")
+        return message
+
+    @staticmethod
+    def read_position(data):
+        """A read frame's "up_to" message id (None: everything); ValueError if malformed."""
+        up_to = data.get("up_to")
+        if up_to is None:
+            return None
+        if isinstance(up_to, bool):
+            raise ValueError("Invalid up_to.")
+        try:
+            return int(up_to)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid up_to.")
+
+    async def reject(self, data, error):
+        # A malformed frame gets an error; the socket stays open
+        await self.send_event({"type": "error", "error": error, "client_id": data.get("client_id")})
+
+    @staticmethod
+    def idempotency_key(client_id):
+        # Anything that doesn't fit the column is just not deduplicated
+        if isinstance(client_id, str) and 0 < len(client_id) <= 64:
+            return client_id
+        return None
+
+    @database_sync_to_async
+    def save_message(self, sender, receiver, message, client_id=None):
+        """Returns (message, created); created is False for a retried client_id."""
+        try:
+            with transaction.atomic():
+                msg = Message.objects.create(
+                    sender_id=sender.id,
+                    receiver_id=receiver.id,
+                    message=message,
+                    seq=Conversation.allocate_seq(sender.id, receiver.id),
+                    client_id=client_id,
+                )
+                Conversation.record_message(msg)
+        except IntegrityError:
+            if client_id is None:
+                raise
+            return Message.objects.get(sender_id=sender.id, client_id=client_id), False
+        return msg, True
+
+    @database_sync_to_async
+    def missed_messages(self, other_user, last_seq):
+        a, b = Conversation.pair_ids(self.user.id, other_user.id)
+        current = (
+            Conversation.objects.filter(user_a_id=a, user_b_id=b)
+            .values_list("last_seq", flat=True)
+            .first()
+        ) or 0
+        messages = list(
+            conversation_messages(self.user, other_user)
+            .filter(seq__gt=last_seq)
+            .order_by("seq")[:RESUME_BATCH_SIZE + 1]
+        )
+        return messages[:RESUME_BATCH_SIZE], len(messages) > RESUME_BATCH_SIZE, current
+
+    @staticmethod
+    def resume_position(data):
+        """A resume frame's "last_seq" (0: from the start); ValueError if malformed."""
+        last_seq = data.get("last_seq") or 0
+        if isinstance(last_seq, bool):
+            raise ValueError("Invalid last_seq.")
+        try:
+            return max(int(last_seq), 0)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid last_seq.")
+
+
+class ChatConsumer(ChatEventsMixin, AsyncWebsocketConsumer):
+    """One socket per conversation: ws/chat/<username>/."""
 
     async def connect(self):
         self.user = self.scope["user"]
@@ -20,11 +550,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         self.other_username = self.scope["url_route"]["kwargs"]["username"]
         self.other_user = await self.get_user(self.other_username)
-
-        # Create unique room name for two users
-        user_ids = sorted([self.user.id, self.other_user.id])
-        self.room_name = f"chat_{user_ids[0]}_{user_ids[1]}"
-        self.room_group_name = f"chat_group_{self.room_name}"
+        self.conversation_id = await self.get_conversation_id(self.other_user)
+        self.room_group_name = room_group_name(self.user.id, self.other_user.id)
+        self.typing = TypingTracker(self.broadcast_typing)
+        self.receipts = ReadReceiptBatcher(self.apply_read)
 
         # Join group
         await self.channel_layer.group_add(
@@ -32,110 +561,237 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        # Follow the other participant's online status
+        await self.channel_layer.group_add(
+            presence_group(self.other_user.id),
+            self.channel_name
+        )
+        await self.register_channel(self.room_group_name)
 
-        # Mark online
-        await self.update_user_status(True)
-        await self.broadcast_user_status(True)
+        await self.accept_negotiated()
+
+        # Count this socket; only the first one marks us online
+        await get_presence().connect(self.user)
+        self.present = True
 
     async def disconnect(self, close_code):
         if hasattr(self, "room_group_name"):
 
-            # Mark offline
-            await self.update_user_status(False)
-            await self.broadcast_user_status(False)
+            # Clear our typing indicator on the other side
+            await self.typing.stop_all()
+            await self.receipts.flush()
+            self.stop_outbox()
+
+            # Don't leave this socket's messages waiting on the timer
+            if write_behind_enabled():
+                await get_buffer().flush()
+
+            # Only the last socket (after a grace period) marks us offline
+            if getattr(self, "present", False):
+                await get_presence().disconnect(self.user)
+            await self.unregister_channel()
 
-            # Leave group
+            # Leave groups
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
+            await self.channel_layer.group_discard(
+                presence_group(self.other_user.id),
+                self.channel_name
+            )
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.decode(text_data, bytes_data)
+        except ValueError as exc:
+            await self.reject({}, str(exc))
+            return
         message_type = data.get("type", "chat_message")
-
+        if message_type == "ack":
+            self.acknowledge(data)
+            return
+        if await self.throttled(message_type, data):
+            return
 
         if message_type == "chat_message":
-            message = data["message"]
-
-            # Save message
-            await self.save_message(self.user, self.other_user, message)
-
-            # Broadcast
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat.message",
-                    "message": message,
-                    "sender": self.user.username,
-                },
+            try:
+                message = self.message_text(data)
+            except ValueError as exc:
+                await self.reject(data, str(exc))
+                return
+            await self.send_chat_message(
+                self.other_user,
+                self.conversation_id,
+                message,
+                data.get("client_id"),
             )
 
         elif message_type == "typing":
-            is_typing = data.get("is_typing", False)
-
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat.typing",
-                    "is_typing": is_typing,
-                    "sender": self.user.username,
-                },
+            await self.send_typing(
+                self.other_user,
+                self.conversation_id,
+                data.get("is_typing", False),
             )
 
+        elif message_type == "read":
+            try:
+                up_to = self.read_position(data)
+            except ValueError as exc:
+                await self.reject(data, str(exc))
+                return
+            await self.send_read(self.other_user, self.conversation_id, up_to)
 
+        elif message_type == "resume":
+            try:
+                last_seq = self.resume_position(data)
+            except ValueError as exc:
+                await self.reject(data, str(exc))
+                return
+            await self.send_resume(self.other_user, self.conversation_id, last_seq)
 
-    async def chat_message(self, event):
-        await self.send(
-            text_data=json.dumps({
-                "type": "chat_message",
-                "message": event["message"],
-                "sender": event["sender"],
-            })
-        )
 
-    async def chat_typing(self, event):
-        await self.send(
-            text_data=json.dumps({
-                "type": "typing",
-                "is_typing": event["is_typing"],
-                "sender": event["sender"],
-            })
-        )
+class InboxConsumer(ChatEventsMixin, AsyncWebsocketConsumer):
+    """
+    One socket per user: ws/inbox/.
 
-    async def broadcast_user_status(self, is_online):
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                "type": "user.status",
-                "username": self.user.username,
-                "is_online": is_online,
-            },
-        )
+    Stays open across conversations. Client frames name their conversation
+    with "conversation" (a Conversation id) or "to" (a username), and every
+    event sent back carries the conversation id.
+    """
 
-    async def user_status(self, event):
-        await self.send(
-            text_data=json.dumps({
-                "type": "user_status",
-                "username": event["username"],
-                "is_online": event["is_online"],
-            })
-        )
+    async def connect(self):
+        self.user = self.scope["user"]
 
+        if not self.user.is_authenticated:
+            await self.close()
+            return
 
-    @database_sync_to_async
-    def get_user(self, username):
-        return User.objects.get(username=username)
+        # conversation id -> other participant, filled as frames arrive
+        self.conversations = {}
+        self.watching = set()
+        self.inbox_group_name = inbox_group_name(self.user.id)
+        self.typing = TypingTracker(self.broadcast_typing)
+        self.receipts = ReadReceiptBatcher(self.apply_read)
 
-    @database_sync_to_async
-    def save_message(self, sender, receiver, message):
-        return Message.objects.create(
-            sender=sender,
-            receiver=receiver,
-            message=message
+        await self.channel_layer.group_add(
+            self.inbox_group_name,
+            self.channel_name
         )
+        await self.register_channel(INBOX)
+
+        await self.accept_negotiated()
+
+        await get_presence().connect(self.user)
+        self.present = True
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "inbox_group_name"):
+
+            await self.typing.stop_all()
+            await self.receipts.flush()
+            self.stop_outbox()
+
+            if write_behind_enabled():
+                await get_buffer().flush()
+
+            if getattr(self, "present", False):
+                await get_presence().disconnect(self.user)
+            await self.unregister_channel()
+
+            await self.channel_layer.group_discard(
+                self.inbox_group_name,
+                self.channel_name
+            )
+            for user_id in self.watching:
+                await self.channel_layer.group_discard(
+                    presence_group(user_id),
+                    self.channel_name
+                )
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.decode(text_data, bytes_data)
+        except ValueError as exc:
+            await self.reject({}, str(exc))
+            return
+        message_type = data.get("type", "chat_message")
+        if message_type == "ack":
+            self.acknowledge(data)
+            return
+        if await self.throttled(message_type, data):
+            return
+
+        try:
+            conversation_id, other_user = await self.resolve_conversation(data)
+        except (Conversation.DoesNotExist, User.DoesNotExist, TypeError, ValueError):
+            await self.reject(data, "Unknown conversation.")
+            return
+
+        if message_type == "chat_message":
+            try:
+                message = self.message_text(data)
+            except ValueError as exc:
+                await self.reject(data, str(exc))
+                return
+            await self.send_chat_message(
+                other_user,
+                conversation_id,
+                message,
+                data.get("client_id"),
+            )
+
+        elif message_type == "typing":
+            await self.send_typing(other_user, conversation_id, data.get("is_typing", False))
+
+        elif message_type == "read":
+            try:
+                up_to = self.read_position(data)
+            except ValueError as exc:
+                await self.reject(data, str(exc))
+                return
+            await self.send_read(other_user, conversation_id, up_to)
+
+        elif message_type == "resume":
+            try:
+                last_seq = self.resume_position(data)
+            except ValueError as exc:
+                await self.reject(data, str(exc))
+                return
+            await self.send_resume(other_user, conversation_id, last_seq)
+
+        elif message_type == "open":
+            # Client switched to this conversation: follow its presence
+            if other_user.id not in self.watching:
+                self.watching.add(other_user.id)
+                await self.channel_layer.group_add(
+                    presence_group(other_user.id),
+                    self.channel_name
+                )
+
+    async def resolve_conversation(self, data):
+        if "conversation" in data:
+            conversation_id = int(data["conversation"])
+            if conversation_id not in self.conversations:
+                self.conversations[conversation_id] = await self.get_participant(conversation_id)
+            return conversation_id, self.conversations[conversation_id]
+
+        if "to" in data:
+            if not isinstance(data["to"], str):
+                raise ValueError("Invalid recipient")
+            other_user = await self.get_user(data["to"])
+            conversation_id = await self.get_conversation_id(other_user)
+            self.conversations[conversation_id] = other_user
+            return conversation_id, other_user
+
+        raise ValueError("Frame names no conversation")
 
     @database_sync_to_async
-    def update_user_status(self, is_online):
-        User.objects.filter(id=self.user.id).update(is_online=is_online)
\ No newline at end of file
+    def get_participant(self, conversation_id):
+        # Only the user's own conversations resolve
+        conversation = (
+            Conversation.involving(self.user.id)
+            .select_related("user_a", "user_b")
+            .get(id=conversation_id)
+        )
+        return conversation.other_user(self.user)
@@ -0,0 +1,166 @@
+import asyncio
+import functools
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async as channels_database_sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from chat_app.metrics import DB_QUEUE_WAIT, metrics_enabled, registry
+
+
+def persist_connections(max_age):
+    """
+    Make this thread's connections persistent for `max_age` seconds.
+
+    DATABASES leaves CONN_MAX_AGE at 0 for request threads; each connection
+    object is per thread, so giving it its own settings copy only changes
+    how long this thread keeps its connection.
+    """
+    for connection in connections.all():
+        connection.settings_dict = {**connection.settings_dict, "CONN_MAX_AGE": max_age}
+
+
+class DatabaseBusy(Exception):
+    """The database executor's backlog stayed full for the whole queue timeout."""
+
+
+class DatabaseExecutor:
+    """
+    A fixed pool of threads for consumer database work.
+
+    Every thread keeps its own connection open between calls for
+    `conn_max_age` seconds, so the pool size is also the number of
+    connections this process holds.
+    At most `threads + queue_limit` calls are admitted at once; the rest
+    wait on the event loop, which stalls the consumer that made them, and
+    give up with DatabaseBusy after `queue_timeout` seconds.
+    """
+
+    def __init__(self, threads, queue_limit, queue_timeout, conn_max_age=0):
+        self.threads = threads
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads,
+            thread_name_prefix="chat-db",
+            initializer=persist_connections,
+            initargs=(conn_max_age,),
+        )
+        # One semaphore per event loop; asyncio primitives can't be shared
+        self._admission = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.queued = 0
+        self.running = 0
+        self.rejected = 0
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._admission.get(loop)
+        if semaphore is None:
+            semaphore = self._admission[loop] = asyncio.Semaphore(self.threads + self.queue_limit)
+        return semaphore
+
+    def _add(self, field, amount):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    async def run(self, func, args, kwargs, shed=True):
+        semaphore = self._semaphore()
+        submitted = time.perf_counter()
+
+        self._add("waiting", 1)
+        try:
+            if shed:
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+            else:
+                await semaphore.acquire()
+        except asyncio.TimeoutError:
+            self._add("rejected", 1)
+            raise DatabaseBusy
+        finally:
+            self._add("waiting", -1)
+
+        def call():
+            self._add("queued", -1)
+            self._add("running", 1)
+            if metrics_enabled():
+                DB_QUEUE_WAIT.observe(time.perf_counter() - submitted)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._add("running", -1)
+
+        self._add("queued", 1)
+        try:
+            return await channels_database_sync_to_async(
+                call, thread_sensitive=False, executor=self.executor
+            )()
+        finally:
+            semaphore.release()
+
+    def on_every_thread(self, func):
+        """Run func once in each worker thread, e.g. to close its connection. Blocks."""
+        barrier = threading.Barrier(self.threads)
+
+        def call():
+            # Hold each thread until all have a task, so none runs two
+            barrier.wait()
+            func()
+
+        for future in [self.executor.submit(call) for _ in range(self.threads)]:
+            future.result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threads": self.threads,
+                "waiting": self.waiting,
+                "queued": self.queued,
+                "running": self.running,
+                "rejected": self.rejected,
+            }
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = DatabaseExecutor(
+            threads=settings.CHAT_DB_THREADS,
+            queue_limit=settings.CHAT_DB_QUEUE_LIMIT,
+            queue_timeout=settings.CHAT_DB_QUEUE_TIMEOUT,
+            conn_max_age=settings.CHAT_DB_CONN_MAX_AGE,
+        )
+    return _executor
+
+
+def database_sync_to_async(func=None, *, shed=True):
+    """
+    channels' database_sync_to_async, run on the bounded DatabaseExecutor.
+
+    Calls made for a client frame raise DatabaseBusy when the executor is
+    saturated; background flushes pass shed=False and wait for a slot
+    instead, since dropping them would lose writes.
+    """
+    if func is None:
+        return functools.partial(database_sync_to_async, shed=shed)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await get_executor().run(func, args, kwargs, shed=shed)
+
+    return wrapper
+
+
+registry.register_collector(
+    "chat_db_executor",
+    "Consumer database executor: threads, calls waiting for admission, queued and running, calls shed.",
+    lambda: get_executor().stats(),
+)
@@ -0,0 +1,110 @@
+import logging
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Registry label of a per-user inbox socket; room sockets are labelled with
+# their room group name
+INBOX = "inbox"
+
+
+class InMemoryDeliveryRegistry:
+    """Channel names of the sockets in this process (InMemoryChannelLayer only)."""
+
+    def __init__(self):
+        self._channels = {}
+
+    async def register(self, user_id, channel_name, label):
+        self._channels.setdefault(user_id, {})[channel_name] = label
+
+    async def unregister(self, user_id, channel_name):
+        channels = self._channels.get(user_id)
+        if channels is not None:
+            channels.pop(channel_name, None)
+            if not channels:
+                del self._channels[user_id]
+
+    async def channels(self, targets):
+        """Channel names for (user_id, label) pairs, or None to use the groups."""
+        found = []
+        for user_id, label in targets:
+            for channel_name, channel_label in self._channels.get(user_id, {}).items():
+                if channel_label == label:
+                    found.append(channel_name)
+        return found
+
+
+class RedisDeliveryRegistry:
+    """
+    Channel names of every worker's sockets, one Redis hash per user
+    (channel name -> label), next to the channels_redis layer.
+    """
+
+    # A crashed worker never unregisters; its entries expire with the hash.
+    # Lookups push the expiry back, and a missing hash sends the caller to
+    # the groups, so a long-lived idle socket is never silently skipped.
+    KEY_TTL = 24 * 60 * 60
+
+    def __init__(self, url, prefix="delivery"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+
+    def _key(self, user_id):
+        return f"{self._prefix}:{user_id}"
+
+    async def register(self, user_id, channel_name, label):
+        key = self._key(user_id)
+        pipe = self._redis.pipeline()
+        pipe.hset(key, channel_name, label)
+        pipe.expire(key, self.KEY_TTL)
+        await pipe.execute()
+
+    async def unregister(self, user_id, channel_name):
+        await self._redis.hdel(self._key(user_id), channel_name)
+
+    async def channels(self, targets):
+        user_ids = list(dict.fromkeys(user_id for user_id, _ in targets))
+        pipe = self._redis.pipeline()
+        for user_id in user_ids:
+            pipe.hgetall(self._key(user_id))
+            pipe.expire(self._key(user_id), self.KEY_TTL)
+        by_user = dict(zip(user_ids, (await pipe.execute())[::2]))
+        if not all(by_user.values()):
+            # Offline, or an entry that expired under an open socket: only
+            # the groups are sure to reach everyone
+            return None
+
+        found = []
+        for user_id, label in targets:
+            for channel_name, channel_label in by_user[user_id].items():
+                if channel_label == label:
+                    found.append(channel_name)
+        return found
+
+
+_registry = None
+_resolved = False
+
+
+def get_delivery_registry():
+    """The configured registry, or None to deliver through groups."""
+    global _registry, _resolved
+    if not _resolved:
+        _resolved = True
+        backend = settings.CHAT_DELIVERY_REGISTRY
+        if backend == "redis":
+            _registry = RedisDeliveryRegistry(settings.CHAT_DELIVERY_REDIS_URL)
+        elif backend == "memory":
+            if isinstance(get_channel_layer(), InMemoryChannelLayer):
+                _registry = InMemoryDeliveryRegistry()
+            else:
+                # Sockets on other workers would be invisible to us
+                logger.warning(
+                    "CHAT_DELIVERY_REGISTRY=memory needs InMemoryChannelLayer; using groups"
+                )
+    return _registry
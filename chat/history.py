@@ -0,0 +1,89 @@
+import base64
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+from .archive import archived_before, message_key
+from .models import Message
+
+
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+# Most messages a reconnecting client is sent in one resume frame
+RESUME_BATCH_SIZE = 500
+
+
+def conversation_messages(user, other_user):
+    return Message.objects.filter(
+        (Q(sender_id=user.id) & Q(receiver_id=other_user.id)) |
+        (Q(sender_id=other_user.id) & Q(receiver_id=user.id))
+    ).select_related('sender')
+
+
+def encode_cursor(message):
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) or raise ValueError for a malformed cursor."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        timestamp, message_id = raw.split("|")
+        return datetime.datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def newest_before(queryset, before=None, limit=HISTORY_PAGE_SIZE):
+    """Newest `limit` rows with a (timestamp, id) key below `before`, newest first."""
+    if before is not None:
+        timestamp, message_id = before
+        queryset = queryset.filter(
+            Q(timestamp__lt=timestamp) |
+            Q(timestamp=timestamp, id__lt=message_id)
+        )
+    return list(queryset.order_by('-timestamp', '-id')[:limit])
+
+
+def page_before(queryset, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Newest `limit` messages older than `cursor`, returned oldest first.
+
+    Keyset pagination on (timestamp, id): each page is a bounded index range
+    scan no matter how deep the user scrolls.
+    """
+    before = decode_cursor(cursor) if cursor else None
+    return _page(newest_before(queryset, before, limit + 1), limit)
+
+
+def history_page(user, other_user, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    page_before over the conversation's hot messages and its archive
+    blocks together. The archive is only consulted for the part of the page
+    the hot table can't fill, so recent pages cost one extra index probe.
+    """
+    before = decode_cursor(cursor) if cursor else None
+    hot = newest_before(conversation_messages(user, other_user), before, limit + 1)
+
+    floor = message_key(hot[limit]) if len(hot) > limit else None
+    cold = archived_before(user.id, other_user.id, before=before, after=floor, limit=limit + 1)
+    if not cold:
+        return _page(hot, limit)
+
+    senders = get_user_model().objects.in_bulk({user.id, other_user.id})
+    for message in cold:
+        message.sender = senders[message.sender_id]
+    return _page(sorted(hot + cold, key=message_key, reverse=True)[:limit + 1], limit)
+
+
+def _page(rows, limit):
+    # rows: up to limit + 1 newest first; the extra one only signals more
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+
+    next_cursor = encode_cursor(rows[0]) if has_more else None
+    return rows, next_cursor
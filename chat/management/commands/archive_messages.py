@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.archive import archive_conversation
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Move read messages older than --older-than-days out of the message table "
+        "into compressed per-conversation archive blocks. Safe to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+        )
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=settings.CHAT_ARCHIVE_BLOCK_SIZE,
+            help="Messages per compressed block.",
+        )
+        parser.add_argument(
+            "--conversation",
+            type=int,
+            help="Only archive this Conversation id.",
+        )
+
+    def handle(self, *args, **options):
+        if options["older_than_days"] < 1 or options["block_size"] < 1:
+            raise CommandError("--older-than-days and --block-size must be at least 1.")
+
+        cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+
+        conversations = Conversation.objects.order_by("id")
+        if options["conversation"] is not None:
+            conversations = conversations.filter(id=options["conversation"])
+
+        moved = touched = 0
+        for conversation in conversations.iterator():
+            count = archive_conversation(conversation, cutoff, options["block_size"])
+            if count:
+                moved += count
+                touched += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} messages from {touched} conversations (older than {cutoff:%Y-%m-%d})."
+        ))
@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Window
+from django.db.models.functions import RowNumber
+
+from chat.models import Conversation, Message
+from chat.sidebar import bump_versions
+
+
+class Command(BaseCommand):
+    help = "Rebuild Conversation rows (last message and unread counters) from existing messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of conversations written per bulk upsert.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        # One aggregate row per direction (sender -> receiver)
+        directions = (
+            Message.objects.order_by()
+            .values("sender_id", "receiver_id")
+            .annotate(
+                last_seq=Max("seq"),
+                unread=Count("id", filter=Q(is_read=False)),
+            )
+        )
+
+        pairs = {}
+        for row in directions.iterator():
+            a, b = Conversation.pair_ids(row["sender_id"], row["receiver_id"])
+            pair = pairs.setdefault((a, b), {"last": None, "last_seq": 0, "unread_a": 0, "unread_b": 0})
+            pair["last_seq"] = max(pair["last_seq"], row["last_seq"] or 0)
+            pair[Conversation.unread_field(a, row["receiver_id"])] += row["unread"]
+
+        # Newest message per direction by (timestamp, id): imported history
+        # can have ids out of time order
+        newest = (
+            Message.objects.annotate(
+                rank=Window(
+                    RowNumber(),
+                    partition_by=[F("sender_id"), F("receiver_id")],
+                    order_by=[F("timestamp").desc(), F("id").desc()],
+                )
+            )
+            .filter(rank=1)
+            .values_list("sender_id", "receiver_id", "timestamp", "id")
+        )
+        for sender_id, receiver_id, timestamp, message_id in newest.iterator():
+            pair = pairs[Conversation.pair_ids(sender_id, receiver_id)]
+            if pair["last"] is None or (timestamp, message_id) > pair["last"]:
+                pair["last"] = (timestamp, message_id)
+
+        conversations = [
+            Conversation(
+                user_a_id=a,
+                user_b_id=b,
+                last_timestamp=pair["last"][0],
+                last_message_id=pair["last"][1],
+                unread_a=pair["unread_a"],
+                unread_b=pair["unread_b"],
+                last_seq=pair["last_seq"],
+            )
+            for (a, b), pair in pairs.items()
+        ]
+
+        with transaction.atomic():
+            Conversation.objects.bulk_create(
+                conversations,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=["user_a", "user_b"],
+                update_fields=["last_message", "last_timestamp", "unread_a", "unread_b", "last_seq"],
+            )
+            # Any sidebar may have changed
+            bump_versions()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Backfilled {len(conversations)} conversations.")
+        )
@@ -0,0 +1,373 @@
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import django
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+
+from chat.db import get_executor
+from chat.persistence import get_buffer, write_behind_enabled
+from chat.routing import websocket_urlpatterns
+from users.models import CustomUser
+
+
+# Lifted for the run unless --rate-limits: the benchmark sends as fast as
+# messages are delivered, which the default limits would refuse
+RATE_LIMIT_SETTINGS = (
+    "CHAT_SOCKET_MESSAGE_LIMIT",
+    "CHAT_USER_MESSAGE_LIMIT",
+    "CHAT_SOCKET_TYPING_LIMIT",
+    "CHAT_USER_TYPING_LIMIT",
+)
+
+BENCH_USER_PREFIX = "bench_load_"
+
+
+class QueryCounter:
+    """execute_wrapper that counts statements on every connection it is installed on."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        # Consumers run their queries in executor threads, each with its
+        # own connection, so hook every connection as it's opened
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class InProcessClient:
+    """A socket driven through the ASGI app in this process."""
+
+    def __init__(self, user, other_user):
+        self.communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/chat/{other_user.username}/"
+        )
+        self.communicator.scope["user"] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise CommandError("In-process socket was rejected.")
+
+    async def send(self, frame):
+        await self.communicator.send_to(text_data=json.dumps(frame))
+
+    async def receive(self, timeout):
+        return json.loads(await self.communicator.receive_from(timeout=timeout))
+
+    async def close(self):
+        # A receive timeout cancels the app; there is nothing left to close
+        if not self.communicator.future.done():
+            await self.communicator.disconnect()
+
+
+class SocketClient:
+    """A real WebSocket against a running server, authenticated by session cookie."""
+
+    def __init__(self, base_url, session_key, other_user):
+        self.url = f"{base_url.rstrip('/')}/ws/chat/{other_user.username}/"
+        self.session_key = session_key
+        self.ws = None
+
+    async def connect(self):
+        import websockets
+
+        self.ws = await websockets.connect(
+            self.url,
+            additional_headers={"Cookie": f"{settings.SESSION_COOKIE_NAME}={self.session_key}"},
+            origin="http://localhost",
+        )
+
+    async def send(self, frame):
+        await self.ws.send(json.dumps(frame))
+
+    async def receive(self, timeout):
+        return json.loads(await asyncio.wait_for(self.ws.recv(), timeout))
+
+    async def close(self):
+        await self.ws.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive N users across M concurrent conversations through the chat socket "
+        "and report throughput, send-to-receive latency, DB queries per message "
+        "and memory per connection as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--conversations", type=int, default=10)
+        parser.add_argument("--messages", type=int, default=50, help="Messages per conversation.")
+        parser.add_argument(
+            "--typing-ratio",
+            type=float,
+            default=0.5,
+            help="Chance of a typing frame before each message (0-1).",
+        )
+        parser.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for delivery.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--daphne",
+            action="store_true",
+            help="Start a local daphne and use real sockets instead of the in-process communicator.",
+        )
+        parser.add_argument("--port", type=int, default=8765, help="Port for --daphne.")
+        parser.add_argument(
+            "--url",
+            help="Use real sockets against an already running server, e.g. ws://127.0.0.1:8000.",
+        )
+        parser.add_argument("--output", help="Also write the JSON report to this file.")
+        parser.add_argument("--keep", action="store_true", help="Don't delete the benchmark users.")
+        parser.add_argument(
+            "--rate-limits",
+            action="store_true",
+            help="Keep the inbound rate limits on (in-process and --daphne runs).",
+        )
+
+    def handle(self, *args, **options):
+        users, conversations = options["users"], options["conversations"]
+        pairs = list(itertools.islice(itertools.combinations(range(users), 2), conversations))
+        if users < 2 or len(pairs) < conversations:
+            raise CommandError(
+                f"{users} users allow at most {users * (users - 1) // 2} conversations."
+            )
+        if options["messages"] < 1:
+            raise CommandError("--messages must be at least 1.")
+        if not 0 <= options["typing_ratio"] <= 1:
+            raise CommandError("--typing-ratio must be between 0 and 1.")
+
+        base_url = options["url"]
+        if options["daphne"] or base_url:
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError("Real-socket runs need the 'websockets' package.")
+
+        if not options["rate_limits"]:
+            for name in RATE_LIMIT_SETTINGS:
+                setattr(settings, name, "0")
+
+        bench_users = self.create_users(users)
+        server = None
+        try:
+            if options["daphne"]:
+                server = self.start_daphne(options["port"], options["rate_limits"])
+                base_url = f"ws://127.0.0.1:{options['port']}"
+
+            report = asyncio.run(self.run(bench_users, pairs, base_url, options))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            if not options["keep"]:
+                CustomUser.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        self.stdout.write(output)
+
+    def create_users(self, count):
+        # Leftovers from an interrupted run would collide on username
+        CustomUser.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+        users = [
+            CustomUser(username=f"{BENCH_USER_PREFIX}{i}", email=f"{BENCH_USER_PREFIX}{i}@bench.invalid")
+            for i in range(count)
+        ]
+        for user in users:
+            user.set_unusable_password()
+        CustomUser.objects.bulk_create(users)
+        return list(CustomUser.objects.filter(username__startswith=BENCH_USER_PREFIX).order_by("id"))
+
+    def start_daphne(self, port, rate_limits):
+        env = dict(os.environ)
+        if not rate_limits:
+            env.update(dict.fromkeys(RATE_LIMIT_SETTINGS, "0"))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "daphne", "-p", str(port), "chat_app.asgi:application"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                return server
+            except OSError:
+                if server.poll() is not None:
+                    break
+                time.sleep(0.1)
+        server.terminate()
+        raise CommandError(f"daphne did not start on port {port}.")
+
+    @staticmethod
+    def session_for(user):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    async def run(self, users, pairs, base_url, options):
+        rng = random.Random(options["seed"])
+        timeout = options["timeout"]
+
+        if base_url:
+            sessions = {}
+            for user in users:
+                sessions[user.id] = await sync_to_async(self.session_for)(user)
+
+            def client(user, other):
+                return SocketClient(base_url, sessions[user.id], other)
+        else:
+            def client(user, other):
+                return InProcessClient(user, other)
+
+        # Two sockets per conversation, one for each participant
+        sockets = []
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        for a, b in pairs:
+            pair = (client(users[a], users[b]), client(users[b], users[a]))
+            for c in pair:
+                await c.connect()
+            sockets.append(pair)
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        # Reconnect everywhere so every connection used from here on is hooked
+        await sync_to_async(connections.close_all)()
+        await sync_to_async(get_executor().on_every_thread)(connections.close_all)
+
+        latencies = []
+        typing_frames = 0
+        throttled_sends = 0
+
+        async def send_message(sender, frame):
+            """Send `frame` until it's accepted and return when the accepted send left."""
+            nonlocal throttled_sends
+            while True:
+                sent = time.perf_counter()
+                await sender.send(frame)
+                # The sender gets either its own echo or an error naming the send
+                while True:
+                    reply = await sender.receive(timeout)
+                    if reply.get("client_id") != frame["client_id"]:
+                        continue
+                    if reply.get("type") == "chat_message":
+                        return sent
+                    if reply.get("type") == "error":
+                        break
+                throttled_sends += 1
+                await asyncio.sleep(reply.get("retry_after") or 0.1)
+
+        async def drive(conversation, pair):
+            nonlocal typing_frames
+            for i in range(options["messages"]):
+                sender, receiver = pair[i % 2], pair[1 - i % 2]
+                if rng.random() < options["typing_ratio"]:
+                    await sender.send({"type": "typing", "is_typing": True})
+                    typing_frames += 1
+
+                client_id = f"{conversation}-{i}"
+                sent = await send_message(
+                    sender, {"type": "chat_message", "message": f"bench {i}", "client_id": client_id}
+                )
+                while True:
+                    frame = await receiver.receive(timeout)
+                    if frame.get("type") == "chat_message" and frame.get("client_id") == client_id:
+                        break
+                latencies.append(time.perf_counter() - sent)
+
+        started = time.perf_counter()
+        drivers = [asyncio.ensure_future(drive(n, pair)) for n, pair in enumerate(sockets)]
+        try:
+            await asyncio.gather(*drivers)
+        except asyncio.TimeoutError:
+            raise CommandError(f"A message was not delivered within {options['timeout']}s.")
+        finally:
+            elapsed = time.perf_counter() - started
+            # One conversation timing out leaves the others mid-run
+            for driver in drivers:
+                driver.cancel()
+            await asyncio.gather(*drivers, return_exceptions=True)
+            if write_behind_enabled():
+                # Count the batched INSERTs this run caused, too
+                await get_buffer().flush()
+            connection_created.disconnect(counter.install)
+            for pair in sockets:
+                for c in pair:
+                    await c.close()
+
+        latencies.sort()
+        messages = len(latencies)
+        return {
+            "config": {
+                "users": len(users),
+                "conversations": len(pairs),
+                "messages_per_conversation": options["messages"],
+                "typing_ratio": options["typing_ratio"],
+                "transport": "socket" if base_url else "in_process",
+                "persistence": settings.CHAT_PERSISTENCE,
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "channel_layer": type(get_channel_layer()).__name__,
+            },
+            "results": {
+                "messages": messages,
+                "typing_frames": typing_frames,
+                # Sends refused with an error frame (rate limit or DB busy) and retried
+                "throttled_sends": throttled_sends,
+                "elapsed_s": round(elapsed, 4),
+                "throughput_msgs_per_s": round(messages / elapsed, 1) if elapsed else None,
+                "latency_ms": {
+                    name: round(percentile(latencies, pct) * 1000, 3)
+                    for name, pct in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+                },
+                # Only meaningful in-process; a separate server keeps its own connections
+                "db_queries_per_message": (
+                    round(counter.count / messages, 2) if messages and not base_url else None
+                ),
+                "memory_per_connection_kb": (
+                    round((after - before) / (2 * len(pairs)) / 1024, 1) if not base_url else None
+                ),
+            },
+        }
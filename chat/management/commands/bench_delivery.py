@@ -0,0 +1,162 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.consumers import ChatEventsMixin, inbox_group_name, room_group_name
+from chat.delivery import INBOX, InMemoryDeliveryRegistry, RedisDeliveryRegistry
+
+
+class SimulatedRedisLayer(InMemoryChannelLayer):
+    """
+    InMemoryChannelLayer charged the round trips channels_redis would make:
+    one per send, two per group_send (member lookup, then the send script).
+    """
+
+    def __init__(self, rtt, **kwargs):
+        super().__init__(**kwargs)
+        self.rtt = rtt
+        self.round_trips = 0
+
+    async def send(self, channel, message):
+        self.round_trips += 1
+        await asyncio.sleep(self.rtt)
+        await super().send(channel, message)
+
+    async def group_send(self, group, message):
+        self.round_trips += 2
+        await asyncio.sleep(2 * self.rtt)
+        for channel in list(self.groups.get(group, {})):
+            await InMemoryChannelLayer.send(self, channel, message)
+
+
+class SimulatedRedisRegistry(InMemoryDeliveryRegistry):
+    """One pipelined round trip per lookup, like RedisDeliveryRegistry."""
+
+    def __init__(self, layer):
+        super().__init__()
+        self.layer = layer
+
+    async def channels(self, targets):
+        self.layer.round_trips += 1
+        await asyncio.sleep(self.layer.rtt)
+        return await super().channels(targets)
+
+
+class Sender(ChatEventsMixin):
+    """Just enough of a consumer to run the real fan-out code."""
+
+    def __init__(self, user_id, channel_layer, registry):
+        self.user = SimpleNamespace(id=user_id)
+        self.channel_layer = channel_layer
+        self.delivery_registry = registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare 1:1 event delivery through channel-layer groups against direct "
+        "sends to registered channel names."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversations", type=int, default=100)
+        parser.add_argument("--events", type=int, default=5000)
+        parser.add_argument(
+            "--layer",
+            choices=["memory", "simulated-redis", "redis"],
+            default="memory",
+            help="simulated-redis adds --rtt-us per round trip to the in-memory layer.",
+        )
+        parser.add_argument(
+            "--rtt-us",
+            type=float,
+            default=1000.0,
+            help="Simulated round trip; asyncio timers are only ~1ms accurate.",
+        )
+        parser.add_argument("--redis-url", default="redis://localhost:6379/0", help="For --layer redis.")
+
+    def handle(self, *args, **options):
+        if options["conversations"] < 1 or options["events"] < 1:
+            raise CommandError("--conversations and --events must be at least 1.")
+        asyncio.run(self.run(options))
+
+    def make_layer(self, options):
+        capacity = options["events"] + 10
+        if options["layer"] == "redis":
+            try:
+                from channels_redis.core import RedisChannelLayer
+            except ImportError:
+                raise CommandError("--layer redis needs channels_redis.")
+            layer = RedisChannelLayer(hosts=[options["redis_url"]], capacity=capacity)
+            registry = RedisDeliveryRegistry(options["redis_url"], prefix="bench_delivery")
+        elif options["layer"] == "simulated-redis":
+            layer = SimulatedRedisLayer(options["rtt_us"] / 1e6, capacity=capacity)
+            registry = SimulatedRedisRegistry(layer)
+        else:
+            layer = InMemoryChannelLayer(capacity=capacity)
+            registry = InMemoryDeliveryRegistry()
+        return layer, registry
+
+    async def run(self, options):
+        layer, registry = self.make_layer(options)
+
+        # Conversation n is between users 2n and 2n+1, each with a room
+        # socket and an inbox socket
+        sockets = []
+        for n in range(options["conversations"]):
+            a, b = 2 * n, 2 * n + 1
+            room = room_group_name(a, b)
+            for user_id in (a, b):
+                for group, label in ((room, room), (inbox_group_name(user_id), INBOX)):
+                    channel = await layer.new_channel()
+                    await layer.group_add(group, channel)
+                    await registry.register(user_id, channel, label)
+                    sockets.append((user_id, channel))
+
+        self.stdout.write(
+            f"{'path':<10}{'events/s':>12}{'us/event':>12}{'delivered':>12}{'trips/event':>13}"
+        )
+        try:
+            for label, path_registry in (("groups", None), ("direct", registry)):
+                senders = [
+                    Sender(2 * n, layer, path_registry) for n in range(options["conversations"])
+                ]
+
+                trips = getattr(layer, "round_trips", 0)
+                start = time.perf_counter()
+                for i in range(options["events"]):
+                    n = i % len(senders)
+                    await senders[n].deliver(2 * n + 1, {"type": "chat.message", "message": f"bench {i}"})
+                elapsed = time.perf_counter() - start
+                trips = getattr(layer, "round_trips", 0) - trips
+
+                # Both paths must reach the same sockets: 4 per event
+                self.stdout.write(
+                    f"{label:<10}"
+                    f"{options['events'] / elapsed:>12.0f}"
+                    f"{elapsed / options['events'] * 1e6:>12.1f}"
+                    f"{await self.drain(layer, sockets):>12}"
+                    f"{trips / options['events'] if hasattr(layer, 'round_trips') else '-':>13}"
+                )
+        finally:
+            for user_id, channel in sockets:
+                await registry.unregister(user_id, channel)
+
+    @staticmethod
+    async def drain(layer, sockets):
+        if isinstance(layer, InMemoryChannelLayer):
+            delivered = sum(queue.qsize() for queue in layer.channels.values())
+            layer.channels.clear()
+            return delivered
+
+        delivered = 0
+        for _, channel in sockets:
+            try:
+                while True:
+                    await asyncio.wait_for(layer.receive(channel), 0.01)
+                    delivered += 1
+            except asyncio.TimeoutError:
+                pass
+        return delivered
@@ -0,0 +1,84 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.protocol import JSONCodec, MsgPackCodec
+
+
+def sample_events(count):
+    # Roughly the mix a busy conversation produces
+    events = []
+    for i in range(count):
+        kind = i % 10
+        if kind < 5:
+            events.append({
+                "type": "chat_message",
+                "conversation": 1042,
+                "message": f"See you at {i % 24}:00, bringing the slides for the review",
+                "sender": "alice_smith",
+                "client_id": f"lq3k9x-{i:06x}",
+            })
+        elif kind < 8:
+            events.append({
+                "type": "typing",
+                "conversation": 1042,
+                "is_typing": kind != 7,
+                "sender": "bob_jones",
+            })
+        elif kind == 8:
+            events.append({"type": "persisted", "id": 88000 + i, "client_id": f"lq3k9x-{i:06x}"})
+        else:
+            events.append({"type": "user_status", "username": "bob_jones", "is_online": True})
+    return events
+
+
+def frame_bytes(frames):
+    total = 0
+    for frame in frames:
+        if "text_data" in frame:
+            total += len(frame["text_data"].encode())
+        else:
+            total += len(frame["bytes_data"])
+    return total
+
+
+class Command(BaseCommand):
+    help = "Compare bytes on the wire and encode cost per event for the JSON and MessagePack chat protocols."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=10000)
+        parser.add_argument("--batch", type=int, default=16, help="Events per frame for the batched run.")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            msgpack_codec = MsgPackCodec()
+        except ImportError:
+            raise CommandError("msgpack is not installed.")
+
+        events = sample_events(options["events"])
+        batch = options["batch"]
+
+        runs = [
+            ("json, 1 event/frame", JSONCodec(), 1),
+            ("msgpack, 1 event/frame", msgpack_codec, 1),
+            (f"msgpack, {batch} events/frame", msgpack_codec, batch),
+        ]
+
+        self.stdout.write(f"{'format':<28}{'bytes/event':>14}{'us/event':>12}{'frames':>10}")
+        for label, codec, size in runs:
+            groups = [events[i:i + size] for i in range(0, len(events), size)]
+
+            best = None
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                frames = [frame for group in groups for frame in codec.encode(group)]
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            self.stdout.write(
+                f"{label:<28}"
+                f"{frame_bytes(frames) / len(events):>14.1f}"
+                f"{best / len(events) * 1e6:>12.2f}"
+                f"{len(frames):>10}"
+            )
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from channels.auth import AuthMiddlewareStack
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from chat.management.commands.bench_chat_load import Command as LoadCommand, QueryCounter, percentile
+from users.models import CustomUser
+from users.ws_auth import WebsocketAuthStack, connection_auth, connection_token
+
+BENCH_USER_PREFIX = "bench_connect_"
+
+
+async def accept(scope, receive, send):
+    """Stands in for the consumer so only the auth middleware is timed."""
+    await receive()
+    if not scope["user"].is_authenticated:
+        await send({"type": "websocket.close", "code": 4001})
+        return
+    await send({"type": "websocket.accept"})
+    await receive()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare WebSocket connect latency and DB queries per connect for "
+        "session-cookie auth against connection-token auth."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--connects", type=int, default=50, help="Connects per user and path.")
+        parser.add_argument("--keep", action="store_true", help="Don't delete the benchmark users.")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["connects"] < 1:
+            raise CommandError("--users and --connects must be at least 1.")
+
+        CustomUser.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+        users = [
+            CustomUser(username=f"{BENCH_USER_PREFIX}{i}", email=f"{BENCH_USER_PREFIX}{i}@bench.invalid")
+            for i in range(options["users"])
+        ]
+        for user in users:
+            user.set_unusable_password()
+        CustomUser.objects.bulk_create(users)
+        users = list(CustomUser.objects.filter(username__startswith=BENCH_USER_PREFIX))
+
+        try:
+            asyncio.run(self.run(users, options))
+        finally:
+            if not options["keep"]:
+                CustomUser.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+
+    async def run(self, users, options):
+        cookies = {}
+        tokens = {}
+        for user in users:
+            session_key = await sync_to_async(LoadCommand.session_for)(user)
+            cookies[user.id] = f"{settings.SESSION_COOKIE_NAME}={session_key}".encode()
+            tokens[user.id] = connection_token(user)
+
+        paths = (
+            ("session", AuthMiddlewareStack(accept), lambda user: ("/ws/inbox/", cookies[user.id])),
+            ("token", WebsocketAuthStack(accept), lambda user: (f"/ws/inbox/?token={tokens[user.id]}", b"")),
+        )
+
+        self.stdout.write(
+            f"{'path':<10}{'connects':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries/connect':>17}"
+        )
+        for label, app, request in paths:
+            # Each path starts cold: fresh connections, empty user cache
+            for user in users:
+                connection_auth.invalidate(user.id)
+            await sync_to_async(connections.close_all)()
+
+            counter = QueryCounter()
+            connection_created.connect(counter.install)
+            latencies = []
+            try:
+                for _ in range(options["connects"]):
+                    for user in users:
+                        path, cookie = request(user)
+                        communicator = WebsocketCommunicator(
+                            app, path, headers=[(b"cookie", cookie)] if cookie else []
+                        )
+                        start = time.perf_counter()
+                        connected, _ = await communicator.connect()
+                        latencies.append(time.perf_counter() - start)
+                        if not connected:
+                            raise CommandError(f"{label} auth refused {user.username}.")
+                        await communicator.disconnect()
+            finally:
+                connection_created.disconnect(counter.install)
+
+            latencies.sort()
+            self.stdout.write(
+                f"{label:<10}"
+                f"{len(latencies):>10}"
+                f"{percentile(latencies, 50) * 1000:>10.3f}"
+                f"{percentile(latencies, 99) * 1000:>10.3f}"
+                f"{counter.count / len(latencies):>17.2f}"
+            )
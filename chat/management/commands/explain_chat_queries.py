@@ -0,0 +1,81 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from chat.history import conversation_messages
+from chat.models import Conversation, Message
+from chat.sidebar import sidebar_conversations
+from users.models import CustomUser
+
+
+# Plan lines that mean "read every row of the table"
+FULL_SCAN_PATTERNS = {
+    "sqlite": re.compile(r"\bSCAN (TABLE )?(?P<table>\w+)\b(?! USING)"),
+    "postgresql": re.compile(r"\bSeq Scan on (?P<table>\w+)"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN on the hot chat queries (history, last message, unread "
+        "count, sidebar) and fail if any of them falls back to a full table scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print every query plan, not only the failing ones.",
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        pattern = FULL_SCAN_PATTERNS.get(vendor)
+        if pattern is None:
+            raise CommandError(f"No full-scan detection for the '{vendor}' backend.")
+
+        # The plans only depend on the shape of the query, not on real rows
+        user = CustomUser(id=1, username="explain")
+        other = CustomUser(id=2, username="explain_other")
+
+        queries = {
+            "history": conversation_messages(user, other).order_by("-timestamp", "-id")[:50],
+            "last_message": conversation_messages(user, other).order_by("-timestamp")[:1],
+            "unread_count": Message.objects.filter(
+                sender=other, receiver=user, is_read=False
+            ),
+            "sidebar": sidebar_conversations(user.id),
+        }
+
+        failures = []
+        for name, queryset in queries.items():
+            plan = self.explain(queryset)
+            scans = [
+                m.group("table")
+                for m in pattern.finditer(plan)
+                if m.group("table") in (Message._meta.db_table, Conversation._meta.db_table)
+            ]
+
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: full scan of {', '.join(scans)}"))
+                self.stdout.write(plan)
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: OK"))
+                if options["verbose_plans"]:
+                    self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f"Full table scans in: {', '.join(failures)}")
+
+    def explain(self, queryset):
+        if connection.vendor != "postgresql":
+            return queryset.explain()
+
+        # On small tables PostgreSQL prefers a seq scan even when an index
+        # fits, so ask whether an index path exists at all.
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
@@ -0,0 +1,123 @@
+import datetime
+import heapq
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from chat.archive import decode_block
+from chat.models import Message, MessageArchiveBlock
+from chat.transfer import open_jsonl
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream every message (hot and archived) to a JSONL file, one object per "
+        "line with sender/receiver usernames. Memory use stays flat at any size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Output path; .gz compresses, - writes to stdout.")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument(
+            "--since",
+            help="Only messages at or after this ISO date or timestamp (TIME_ZONE if it has no offset).",
+        )
+        parser.add_argument(
+            "--no-archive",
+            action="store_true",
+            help="Skip messages moved to archive blocks by archive_messages.",
+        )
+
+    def handle(self, *args, **options):
+        since = self.parse_since(options["since"]) if options["since"] else None
+        chunk_size = options["chunk_size"]
+
+        # Usernames come from the join, never a per-row lookup
+        rows = Message.objects.order_by("timestamp", "id").values_list(
+            "id", "sender__username", "receiver__username", "message", "timestamp", "is_read", "seq"
+        )
+        if since is not None:
+            rows = rows.filter(timestamp__gte=since)
+        rows = rows.iterator(chunk_size=chunk_size)
+
+        if not options["no_archive"]:
+            # One stream in (timestamp, id) order, so an import that assigns
+            # fresh ids keeps them in time order
+            rows = heapq.merge(rows, self.archived(since, chunk_size), key=lambda row: (row[4], row[0]))
+
+        exported = 0
+        with open_jsonl(options["output"], "w") as out:
+            for row in rows:
+                out.write(self.line(*row))
+                exported += 1
+
+        log = self.stderr if options["output"] == "-" else self.stdout
+        log.write(self.style.SUCCESS(f"Exported {exported} messages."))
+
+    @staticmethod
+    def parse_since(value):
+        """--since as an aware datetime; a plain date means its midnight."""
+        try:
+            since = parse_datetime(value)
+            if since is None:
+                date = parse_date(value)
+                since = datetime.datetime.combine(date, datetime.time()) if date else None
+        except ValueError:
+            # Well formed but out of range, e.g. month 13
+            since = None
+        if since is None:
+            raise CommandError(f"--since {value!r} is not an ISO date or timestamp.")
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def archived(self, since, chunk_size):
+        """
+        Archived messages as export rows in (timestamp, id) order. Blocks
+        come in order of their first message, and a decoded message is held
+        back only until no block still to come can start before it, so just
+        the blocks that overlap in time are in memory at once.
+        """
+        blocks = MessageArchiveBlock.objects.order_by("first_timestamp", "first_id")
+        if since is not None:
+            blocks = blocks.filter(last_timestamp__gte=since)
+
+        usernames = {}
+        pending = []
+        # A block decompresses to at most CHAT_ARCHIVE_BLOCK_SIZE messages
+        block_rows = blocks.values_list("first_timestamp", "first_id", "data")
+        for first_timestamp, first_id, data in block_rows.iterator(chunk_size=max(chunk_size // 100, 1)):
+            while pending and pending[0][:2] < (first_timestamp, first_id):
+                yield heapq.heappop(pending)[2]
+
+            messages = decode_block(data)
+            missing = {m.sender_id for m in messages} | {m.receiver_id for m in messages}
+            missing -= usernames.keys()
+            if missing:
+                usernames.update(
+                    CustomUser.objects.filter(id__in=missing).values_list("id", "username")
+                )
+
+            for m in messages:
+                if since is not None and m.timestamp < since:
+                    continue
+                row = (m.id, usernames[m.sender_id], usernames[m.receiver_id], m.message, m.timestamp, m.is_read, m.seq)
+                heapq.heappush(pending, (m.timestamp, m.id, row))
+
+        while pending:
+            yield heapq.heappop(pending)[2]
+
+    @staticmethod
+    def line(message_id, sender, receiver, message, timestamp, is_read, seq):
+        return json.dumps({
+            "id": message_id,
+            "sender": sender,
+            "receiver": receiver,
+            "message": message,
+            "timestamp": timestamp.isoformat(),
+            "is_read": is_read,
+            "seq": seq,
+        }, ensure_ascii=False) + "\n"
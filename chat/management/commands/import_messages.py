@@ -0,0 +1,176 @@
+import json
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from chat.models import Conversation, Message
+from chat.transfer import open_jsonl, read_checkpoint, write_checkpoint
+from users.models import CustomUser
+
+
+@contextmanager
+def explicit_timestamps():
+    # bulk_create would stamp every row with now() through auto_now_add
+    field = Message._meta.get_field("timestamp")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Load messages from an export_messages JSONL file (.gz or plain, - for "
+        "stdin) in batched bulk INSERTs, checkpointing the line offset after "
+        "every batch so an interrupted import can --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--checkpoint",
+            help="Offset file; defaults to <input>.checkpoint.",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Skip the lines the checkpoint says are already imported.",
+        )
+        parser.add_argument(
+            "--keep-ids",
+            action="store_true",
+            help="Keep exported message ids and sequence numbers (skipping ids that "
+                 "already exist), which also makes re-running a batch harmless.",
+        )
+        parser.add_argument(
+            "--create-missing-users",
+            action="store_true",
+            help="Create users that don't exist (with an unusable password) instead of skipping their messages.",
+        )
+        parser.add_argument(
+            "--no-backfill",
+            action="store_true",
+            help="Don't rebuild conversations (sidebar, unread counts) afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if options["input"] == "-" and options["resume"] and not options["checkpoint"]:
+            raise CommandError("--resume from stdin needs an explicit --checkpoint.")
+
+        checkpoint = options["checkpoint"] or f"{options['input']}.checkpoint"
+        offset = read_checkpoint(checkpoint) if options["resume"] else 0
+
+        self.user_ids = {}
+        self.keep_ids = options["keep_ids"]
+        self.create_missing = options["create_missing_users"]
+        imported = skipped = 0
+
+        with open_jsonl(options["input"], "r") as lines, explicit_timestamps():
+            # Lines before the checkpoint are read but never parsed
+            for _ in islice(lines, offset):
+                pass
+
+            while True:
+                batch = list(islice(lines, options["batch_size"]))
+                if not batch:
+                    break
+
+                try:
+                    records = [json.loads(line) for line in batch]
+                except json.JSONDecodeError as exc:
+                    raise CommandError(f"Bad JSON near line {offset + 1}: {exc}")
+
+                messages = self.build(records)
+                skipped += len(records) - len(messages)
+                with transaction.atomic():
+                    if not self.keep_ids:
+                        self.number(messages)
+                    Message.objects.bulk_create(messages, ignore_conflicts=options["keep_ids"])
+
+                offset += len(batch)
+                imported += len(messages)
+                write_checkpoint(checkpoint, offset)
+
+        if options["keep_ids"]:
+            self.reset_sequence()
+        if not options["no_backfill"]:
+            call_command("backfill_conversations", stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} messages ({skipped} skipped for unknown users); "
+            f"checkpoint at line {offset}."
+        ))
+
+    def build(self, records):
+        self.resolve({r["sender"] for r in records} | {r["receiver"] for r in records})
+
+        messages = []
+        for record in records:
+            sender_id = self.user_ids.get(record["sender"])
+            receiver_id = self.user_ids.get(record["receiver"])
+            if sender_id is None or receiver_id is None:
+                continue
+            messages.append(Message(
+                id=record["id"] if self.keep_ids else None,
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                message=record["message"],
+                timestamp=parse_datetime(record["timestamp"]),
+                is_read=record["is_read"],
+                seq=record.get("seq") if self.keep_ids else None,
+            ))
+        return messages
+
+    @staticmethod
+    def number(messages):
+        """
+        Give the batch the next sequence numbers of their conversations, in
+        file order (export_messages writes oldest first), so resume reaches
+        imported history. Runs in the batch's transaction, like a live send.
+        """
+        counts = Counter(Conversation.pair_ids(m.sender_id, m.receiver_id) for m in messages)
+        next_seq = {pair: Conversation.allocate_seq(*pair, count=count) for pair, count in counts.items()}
+        for m in messages:
+            pair = Conversation.pair_ids(m.sender_id, m.receiver_id)
+            m.seq = next_seq[pair]
+            next_seq[pair] += 1
+
+    def resolve(self, usernames):
+        # One query per batch for names not seen yet; unknown names are
+        # cached as None so they aren't looked up again
+        missing = usernames - self.user_ids.keys()
+        if not missing:
+            return
+        found = dict(CustomUser.objects.filter(username__in=missing).values_list("username", "id"))
+
+        if self.create_missing:
+            # Emails are unique, so each placeholder gets its own
+            new_users = [
+                CustomUser(username=name, email=f"{name}@imported.invalid")
+                for name in missing - found.keys()
+            ]
+            for user in new_users:
+                user.set_unusable_password()
+            CustomUser.objects.bulk_create(new_users)
+            found.update(
+                CustomUser.objects.filter(username__in=missing - found.keys()).values_list("username", "id")
+            )
+
+        for name in missing:
+            self.user_ids[name] = found.get(name)
+
+    def reset_sequence(self):
+        # Explicit ids don't advance PostgreSQL's sequence
+        statements = connection.ops.sequence_reset_sql(self.style, [Message])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
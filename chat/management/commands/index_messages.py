@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from chat.search import install_index, rebuild_index, uninstall_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Build or rebuild the full-text message index (SQLite FTS5 or "
+        "PostgreSQL tsvector/GIN). New messages are indexed automatically; "
+        "this is only needed for the initial load or a repair."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Remove the index, its triggers and columns instead.",
+        )
+
+    def handle(self, *args, **options):
+        if options["drop"]:
+            uninstall_index(connection)
+            self.stdout.write(self.style.SUCCESS("Full-text index removed."))
+            return
+
+        if not install_index(connection):
+            self.stdout.write(
+                self.style.WARNING(
+                    f"No full-text index on this '{connection.vendor}' database; "
+                    "search falls back to substring matching."
+                )
+            )
+            return
+
+        start = time.monotonic()
+        rebuild_index(connection)
+        self.stdout.write(
+            self.style.SUCCESS(f"Reindexed messages in {time.monotonic() - start:.2f}s.")
+        )
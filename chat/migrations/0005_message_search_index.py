@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from chat.search import install_index
+    install_index(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from chat.search import uninstall_index
+    uninstall_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_conversation_indexes'),
+    ]
+
+    operations = [
+        # FTS5 table + triggers on SQLite (skipped if the build lacks FTS5),
+        # generated tsvector + GIN on PostgreSQL; rows written from here on
+        # are indexed automatically.
+        # Run `manage.py index_messages` once to index existing messages.
+        migrations.RunPython(install, uninstall),
+    ]
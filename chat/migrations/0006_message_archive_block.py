@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchiveBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_timestamp', models.DateTimeField()),
+                ('first_id', models.BigIntegerField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('last_id', models.BigIntegerField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_blocks', to='chat.conversation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['conversation', '-last_timestamp', '-last_id'], name='chat_archive_conv_last_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:59
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def number_messages(apps, schema_editor):
+    # Existing messages get their conversation's sequence in send order.
+    # Pairs come from the messages themselves: a pair may have no
+    # Conversation row yet if backfill_conversations hasn't run.
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+
+    pairs = {
+        tuple(sorted(pair))
+        for pair in Message.objects.values_list('sender_id', 'receiver_id').distinct().iterator()
+    }
+    for a, b in sorted(pairs):
+        ids = Message.objects.filter(
+            (Q(sender_id=a) & Q(receiver_id=b)) | (Q(sender_id=b) & Q(receiver_id=a))
+        ).order_by('timestamp', 'id').values_list('id', flat=True)
+
+        seq = 0
+        batch = []
+        for message_id in list(ids):
+            seq += 1
+            batch.append(Message(id=message_id, seq=seq))
+            if len(batch) == 2000:
+                Message.objects.bulk_update(batch, ['seq'])
+                batch = []
+        Message.objects.bulk_update(batch, ['seq'])
+        Conversation.objects.update_or_create(user_a_id=a, user_b_id=b, defaults={'last_seq': seq})
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_archive_block'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='client_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'receiver', 'seq'], name='chat_msg_pair_seq_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_id__isnull', False)), fields=('sender', 'client_id'), name='chat_msg_sender_client_uniq'),
+        ),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+    ]
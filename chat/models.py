@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
 from django.conf import settings
 
+from .sidebar import bump_versions
+
 class Message(models.Model):
     sender = models.ForeignKey(
         settings.AUTH_USER_MODEL, 
@@ -15,9 +18,224 @@ class Message(models.Model):
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    # Position in the conversation (Conversation.last_seq hands them out);
+    # a reconnecting client asks for everything after the last one it saw
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
+    # Sender-chosen idempotency key: a retried send with the same key is
+    # acknowledged with the stored message instead of being saved again
+    client_id = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         ordering = ('timestamp',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sender', 'client_id'],
+                condition=Q(client_id__isnull=False),
+                name='chat_msg_sender_client_uniq',
+            ),
+        ]
+        indexes = [
+            # History and last-message lookups for a (sender, receiver) pair
+            models.Index(
+                fields=['sender', 'receiver', 'timestamp'],
+                name='chat_msg_pair_ts_idx',
+            ),
+            # Unread counts only ever look at the small is_read=False slice
+            models.Index(
+                fields=['receiver', 'sender'],
+                condition=Q(is_read=False),
+                name='chat_msg_unread_idx',
+            ),
+            # Resume: everything after a sequence number, per direction
+            models.Index(
+                fields=['sender', 'receiver', 'seq'],
+                name='chat_msg_pair_seq_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.sender} to {self.receiver}: {self.message[:20]}'
+
+
+class Conversation(models.Model):
+    # Participants are stored sorted by id (user_a.id < user_b.id), the same
+    # pairing ChatConsumer uses for its room name.
+    user_a = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='conversations_as_a'
+    )
+    user_b = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='conversations_as_b'
+    )
+    last_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    unread_a = models.PositiveIntegerField(default=0)
+    unread_b = models.PositiveIntegerField(default=0)
+    last_seq = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='unique_conversation_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['user_a', '-last_timestamp']),
+            models.Index(fields=['user_b', '-last_timestamp']),
+        ]
+
+    def __str__(self):
+        return f'{self.user_a_id} <-> {self.user_b_id}'
+
+    @staticmethod
+    def pair_ids(user1_id, user2_id):
+        return tuple(sorted((user1_id, user2_id)))
+
+    @classmethod
+    def for_users(cls, user1_id, user2_id):
+        a, b = cls.pair_ids(user1_id, user2_id)
+        conversation, _ = cls.objects.get_or_create(user_a_id=a, user_b_id=b)
+        return conversation
+
+    @classmethod
+    def allocate_seq(cls, user1_id, user2_id, count=1):
+        """
+        Reserve `count` consecutive sequence numbers for the pair and return
+        the first. Must run inside the transaction that saves the messages:
+        the UPDATE holds the conversation's row lock until commit, so
+        concurrent senders get disjoint, gap-free ranges.
+        """
+        a, b = cls.pair_ids(user1_id, user2_id)
+        conversations = cls.objects.filter(user_a_id=a, user_b_id=b)
+        if not conversations.update(last_seq=F('last_seq') + count):
+            cls.for_users(a, b)
+            conversations.update(last_seq=F('last_seq') + count)
+        return conversations.values_list('last_seq', flat=True).get() - count + 1
+
+    @classmethod
+    def involving(cls, user_id):
+        return cls.objects.filter(Q(user_a_id=user_id) | Q(user_b_id=user_id))
+
+    @staticmethod
+    def unread_field(conversation_a_id, receiver_id):
+        return 'unread_a' if receiver_id == conversation_a_id else 'unread_b'
+
+    def other_user(self, user):
+        return self.user_b if user.id == self.user_a_id else self.user_a
+
+    def unread_for(self, user):
+        return self.unread_a if user.id == self.user_a_id else self.unread_b
+
+    @classmethod
+    def record_message(cls, message):
+        """Fold a freshly saved message into its conversation."""
+        return cls.record_messages([message])[0]
+
+    @classmethod
+    def record_messages(cls, messages):
+        """
+        Fold a batch of saved messages into their conversations with one
+        UPDATE per conversation touched.
+        """
+        latest = {}
+        unread = {}
+        for message in messages:
+            pair = cls.pair_ids(message.sender_id, message.receiver_id)
+            if pair not in latest or message.id > latest[pair].id:
+                latest[pair] = message
+            field = cls.unread_field(pair[0], message.receiver_id)
+            counts = unread.setdefault(pair, {})
+            counts[field] = counts.get(field, 0) + 1
+
+        conversations = []
+        with transaction.atomic():
+            for pair, message in latest.items():
+                conversation = cls.for_users(*pair)
+                newer = Q(last_message__isnull=True) | Q(last_message_id__lt=message.id)
+
+                cls.objects.filter(pk=conversation.pk).update(
+                    last_message_id=Case(
+                        When(newer, then=Value(message.id)),
+                        default=F('last_message_id'),
+                        output_field=models.BigIntegerField(),
+                    ),
+                    last_timestamp=Case(
+                        When(newer, then=Value(message.timestamp)),
+                        default=F('last_timestamp'),
+                    ),
+                    **{field: F(field) + count for field, count in unread[pair].items()},
+                )
+                conversations.append(conversation)
+            bump_versions(user_id for pair in latest for user_id in pair)
+        return conversations
+
+    @classmethod
+    def mark_read(cls, reader_id, other_id, up_to=None):
+        """
+        Mark what other_id sent to reader_id as read, up to and including
+        message id `up_to` (everything if None), as one range UPDATE, and
+        keep the unread counter in step. Returns the number of messages marked.
+        """
+        unread_messages = Message.objects.filter(
+            sender_id=other_id, receiver_id=reader_id, is_read=False
+        )
+        if up_to is not None:
+            unread_messages = unread_messages.filter(id__lte=up_to)
+
+        a, b = cls.pair_ids(reader_id, other_id)
+        unread = cls.unread_field(a, reader_id)
+
+        with transaction.atomic():
+            updated = unread_messages.update(is_read=True)
+            if up_to is None:
+                cls.objects.filter(user_a_id=a, user_b_id=b).update(**{unread: 0})
+            elif updated:
+                cls.objects.filter(user_a_id=a, user_b_id=b).update(**{
+                    unread: Case(
+                        When(**{f'{unread}__gt': updated}, then=F(unread) - updated),
+                        default=Value(0),
+                    ),
+                })
+            if updated:
+                bump_versions([reader_id])
+        return updated
+
+
+class MessageArchiveBlock(models.Model):
+    """
+    Up to CHAT_ARCHIVE_BLOCK_SIZE old messages of one conversation, moved
+    out of chat_message by `manage.py archive_messages` and stored as one
+    zlib-compressed JSON array (see chat/archive.py). Blocks are read back
+    transparently by the history views.
+    """
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='archive_blocks'
+    )
+    first_timestamp = models.DateTimeField()
+    first_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['conversation', '-last_timestamp', '-last_id'],
+                name='chat_archive_conv_last_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.conversation_id}: {self.message_count} messages up to {self.last_timestamp}'
+
@@ -0,0 +1,168 @@
+import asyncio
+import atexit
+import logging
+from dataclasses import dataclass
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from .db import database_sync_to_async
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingMessage:
+    sender_id: int
+    receiver_id: int
+    message: str
+    reply_channel: str = None
+    client_id: str = None
+
+
+class WriteBehindBuffer:
+    """
+    Per-process queue of chat messages waiting to be written.
+
+    Messages are broadcast before they reach the database; the buffer writes
+    them with one bulk_create once `batch_size` are queued or `flush_interval`
+    seconds have passed, then sends a "message.persisted" event with the new
+    row id to the sender's channel.
+    """
+
+    def __init__(self, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        atexit.register(self.flush_sync)
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def enqueue(self, sender_id, receiver_id, message, reply_channel=None, client_id=None):
+        self._pending.append(
+            PendingMessage(sender_id, receiver_id, message, reply_channel, client_id)
+        )
+
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.flush_interval, self._flush_later)
+
+    def _flush_later(self):
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return []
+
+        try:
+            messages = await database_sync_to_async(self._write, shed=False)(batch)
+        except Exception:
+            logger.exception("Write-behind flush of %d messages failed", len(batch))
+            await self._ack(batch, [None] * len(batch))
+            return []
+
+        await self._ack(batch, messages)
+        return messages
+
+    async def _ack(self, batch, messages):
+        channel_layer = get_channel_layer()
+        for pending, message in zip(batch, messages):
+            if not pending.reply_channel:
+                continue
+            await channel_layer.send(
+                pending.reply_channel,
+                {
+                    "type": "message.persisted",
+                    "id": message.id if message else None,
+                    "client_id": pending.client_id,
+                    "seq": message.seq if message else None,
+                },
+            )
+
+    @staticmethod
+    def _write(batch):
+        """Store the batch; returns the message for each entry, in order."""
+        with transaction.atomic():
+            # Retried sends (same sender and client_id) resolve to the row
+            # stored the first time, whether earlier or in this batch
+            keyed = [p for p in batch if p.client_id]
+            stored = {}
+            if keyed:
+                stored = {
+                    (m.sender_id, m.client_id): m
+                    for m in Message.objects.filter(
+                        sender_id__in={p.sender_id for p in keyed},
+                        client_id__in={p.client_id for p in keyed},
+                    )
+                }
+
+            new_messages = []
+            results = []
+            for pending in batch:
+                key = (pending.sender_id, pending.client_id)
+                if pending.client_id and key in stored:
+                    results.append(stored[key])
+                    continue
+                message = Message(
+                    sender_id=pending.sender_id,
+                    receiver_id=pending.receiver_id,
+                    message=pending.message,
+                    client_id=pending.client_id,
+                )
+                new_messages.append(message)
+                results.append(message)
+                if pending.client_id:
+                    stored[key] = message
+
+            # One range of sequence numbers per conversation, in send order
+            pairs = {}
+            for message in new_messages:
+                pair = Conversation.pair_ids(message.sender_id, message.receiver_id)
+                pairs.setdefault(pair, []).append(message)
+            for pair, messages in pairs.items():
+                first = Conversation.allocate_seq(*pair, count=len(messages))
+                for offset, message in enumerate(messages):
+                    message.seq = first + offset
+
+            Message.objects.bulk_create(new_messages)
+            Conversation.record_messages(new_messages)
+        return results
+
+    def flush_sync(self):
+        # Interpreter shutdown: no event loop left to send acks on, but the
+        # rows must not be lost.
+        batch, self._pending = self._pending, []
+        if batch:
+            self._write(batch)
+
+
+_buffer = None
+
+
+def write_behind_enabled():
+    return settings.CHAT_PERSISTENCE == "write_behind"
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        _buffer = WriteBehindBuffer(
+            batch_size=settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+            flush_interval=settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL,
+        )
+    return _buffer
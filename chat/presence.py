@@ -0,0 +1,248 @@
+import asyncio
+import atexit
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from users.cache import user_cache
+
+from .db import database_sync_to_async
+from .sidebar import bump_contacts
+
+logger = logging.getLogger(__name__)
+
+
+def presence_group(user_id):
+    """Group every socket watching `user_id`'s online status joins."""
+    return f"presence_{user_id}"
+
+
+class InMemoryPresenceBackend:
+    """Connection counts for a single process (runserver, one daphne worker)."""
+
+    def __init__(self):
+        self._counts = {}
+
+    async def incr(self, user_id):
+        self._counts[user_id] = self._counts.get(user_id, 0) + 1
+        return self._counts[user_id]
+
+    async def decr(self, user_id):
+        count = max(self._counts.get(user_id, 0) - 1, 0)
+        if count:
+            self._counts[user_id] = count
+        else:
+            self._counts.pop(user_id, None)
+        return count
+
+    async def count(self, user_id):
+        return self._counts.get(user_id, 0)
+
+    def local_users(self):
+        return list(self._counts)
+
+
+class RedisPresenceBackend:
+    """
+    Connection counts shared by every worker through Redis, the same server
+    channels_redis uses for the channel layer.
+    """
+
+    # A crashed worker never decrements; stale counts expire on their own.
+    # Live workers re-arm the keys of users they hold sockets for every
+    # REFRESH_INTERVAL, so a count never expires under an open socket.
+    KEY_TTL = 24 * 60 * 60
+    REFRESH_INTERVAL = 60 * 60
+
+    def __init__(self, url, prefix="presence"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+        # user id -> sockets this process holds
+        self._local = {}
+        self._refresher = None
+
+    def _key(self, user_id):
+        return f"{self._prefix}:{user_id}"
+
+    async def incr(self, user_id):
+        self._local[user_id] = self._local.get(user_id, 0) + 1
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.ensure_future(self._refresh_forever())
+
+        key = self._key(user_id)
+        pipe = self._redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, self.KEY_TTL)
+        count, _ = await pipe.execute()
+        return count
+
+    async def decr(self, user_id):
+        local = self._local.get(user_id, 0) - 1
+        if local > 0:
+            self._local[user_id] = local
+        else:
+            self._local.pop(user_id, None)
+
+        key = self._key(user_id)
+        count = await self._redis.decr(key)
+        if count <= 0:
+            await self._redis.delete(key)
+            return 0
+        return count
+
+    async def count(self, user_id):
+        value = await self._redis.get(self._key(user_id))
+        return max(int(value or 0), 0)
+
+    async def refresh(self):
+        if not self._local:
+            return
+        pipe = self._redis.pipeline()
+        for user_id in self._local:
+            pipe.expire(self._key(user_id), self.KEY_TTL)
+        await pipe.execute()
+
+    async def _refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Presence TTL refresh of %d users failed", len(self._local))
+
+    def local_users(self):
+        # Counts are shared with other workers; ours expire via KEY_TTL
+        return []
+
+
+class PresenceService:
+    """
+    Reference-counted presence.
+
+    Every socket calls connect()/disconnect(); only the 0 -> 1 and 1 -> 0
+    transitions are broadcast. Going offline waits `debounce` seconds so a
+    page reload doesn't flicker the status, and is_online/last_seen are
+    written to the user table in batches every `flush_interval` seconds.
+    """
+
+    def __init__(self, backend, debounce, flush_interval):
+        self.backend = backend
+        self.debounce = debounce
+        self.flush_interval = flush_interval
+        self._offline_timers = {}
+        self._dirty = {}
+        self._flush_timer = None
+        self._tasks = set()
+        atexit.register(self.flush_sync)
+
+    async def connect(self, user):
+        user_id = user.id
+        count = await self.backend.incr(user_id)
+
+        timer = self._offline_timers.pop(user_id, None)
+        if timer is not None:
+            # Reconnected inside the debounce window: nobody saw us leave
+            timer.cancel()
+            return count
+
+        if count == 1:
+            await self._transition(user, True)
+        return count
+
+    async def disconnect(self, user):
+        count = await self.backend.decr(user.id)
+
+        if count == 0 and user.id not in self._offline_timers:
+            loop = asyncio.get_running_loop()
+            self._offline_timers[user.id] = loop.call_later(
+                self.debounce, self._spawn, self._expire, user
+            )
+        return count
+
+    async def is_online(self, user_id):
+        return await self.backend.count(user_id) > 0
+
+    async def _expire(self, user):
+        self._offline_timers.pop(user.id, None)
+        # Another worker may have picked the user up in the meantime
+        if await self.backend.count(user.id) == 0:
+            await self._transition(user, False)
+
+    async def _transition(self, user, is_online):
+        self._dirty[user.id] = (is_online, timezone.now())
+        if self._flush_timer is None:
+            loop = asyncio.get_running_loop()
+            self._flush_timer = loop.call_later(self.flush_interval, self._spawn, self.flush)
+
+        await get_channel_layer().group_send(
+            presence_group(user.id),
+            {
+                "type": "user.status",
+                "user_id": user.id,
+                "username": user.username,
+                "is_online": is_online,
+            },
+        )
+
+    def _spawn(self, func, *args):
+        task = asyncio.ensure_future(func(*args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        self._flush_timer = None
+        dirty, self._dirty = self._dirty, {}
+        if dirty:
+            try:
+                await database_sync_to_async(self._write, shed=False)(dirty)
+            except Exception:
+                logger.exception("Presence flush of %d users failed", len(dirty))
+
+    @staticmethod
+    def _write(dirty):
+        User = get_user_model()
+        # One CASE ... WHEN UPDATE per batch: each user keeps their own
+        # transition time
+        users = [
+            User(id=user_id, is_online=is_online, last_seen=seen)
+            for user_id, (is_online, seen) in dirty.items()
+        ]
+        with transaction.atomic():
+            User.objects.bulk_update(users, ["is_online", "last_seen"], batch_size=500)
+        # update() skips the save signals
+        user_cache.invalidate_many(dirty)
+        bump_contacts(dirty)
+
+    def flush_sync(self):
+        dirty, self._dirty = self._dirty, {}
+        # Pending offline transitions would have fired, and with a
+        # process-local backend every counted user leaves with us
+        now = timezone.now()
+        for user_id in set(self._offline_timers) | set(self.backend.local_users()):
+            dirty[user_id] = (False, now)
+        if dirty:
+            self._write(dirty)
+
+
+_presence = None
+
+
+def get_presence():
+    global _presence
+    if _presence is None:
+        if settings.CHAT_PRESENCE_BACKEND == "redis":
+            backend = RedisPresenceBackend(settings.CHAT_PRESENCE_REDIS_URL)
+        else:
+            backend = InMemoryPresenceBackend()
+        _presence = PresenceService(
+            backend,
+            debounce=settings.CHAT_PRESENCE_DEBOUNCE,
+            flush_interval=settings.CHAT_PRESENCE_FLUSH_INTERVAL,
+        )
+    return _presence
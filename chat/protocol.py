@@ -0,0 +1,97 @@
+"""
+Wire formats for the chat sockets.
+
+JSON text frames (one event per frame) stay the default. A client can ask
+for the compact format by offering the "chat.msgpack.v1" subprotocol or
+connecting with ?proto=msgpack. Compact frames are binary MessagePack
+arrays holding one or more events, each event encoded positionally as
+[type code, *values] so field names never go over the wire.
+"""
+import json
+from urllib.parse import parse_qs
+
+
+MSGPACK_SUBPROTOCOL = "chat.msgpack.v1"
+
+# Positional layout of every server -> client event. Append new fields at
+# the end and new types with a new code; never reorder.
+EVENT_SCHEMA = {
+    "chat_message": (1, ("conversation", "message", "sender", "client_id", "id", "seq")),
+    "typing": (2, ("conversation", "is_typing", "sender")),
+    "read": (3, ("conversation", "reader", "up_to")),
+    "persisted": (4, ("id", "client_id", "seq")),
+    "user_status": (5, ("username", "is_online")),
+    "error": (6, ("error", "client_id", "retry_after")),
+    "resume": (7, ("conversation", "messages", "has_more", "last_seq")),
+}
+EVENT_TYPES = {code: (name, fields) for name, (code, fields) in EVENT_SCHEMA.items()}
+
+
+class JSONCodec:
+    name = "json"
+    subprotocol = None
+    batches = False
+
+    def encode(self, events):
+        # One text frame per event, exactly as before
+        return [{"text_data": json.dumps(event)} for event in events]
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MsgPackCodec:
+    name = "msgpack"
+    subprotocol = MSGPACK_SUBPROTOCOL
+    batches = True
+
+    def __init__(self):
+        import msgpack
+
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    @staticmethod
+    def pack_event(event):
+        schema = EVENT_SCHEMA.get(event.get("type"))
+        if schema is None:
+            return event
+        code, fields = schema
+        return [code, *(event.get(field) for field in fields)]
+
+    @staticmethod
+    def unpack_event(item):
+        if isinstance(item, dict):
+            return item
+        name, fields = EVENT_TYPES[item[0]]
+        event = dict(zip(fields, item[1:]))
+        event["type"] = name
+        return event
+
+    def encode(self, events):
+        # All pending events in a single binary frame
+        return [{"bytes_data": self._packb([self.pack_event(e) for e in events])}]
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return json.loads(text_data)
+        data = self._unpackb(bytes_data)
+        # Clients send a single map (or positional array) per frame
+        if isinstance(data, list) and data and isinstance(data[0], int):
+            return self.unpack_event(data)
+        return data
+
+
+def negotiate(scope):
+    """Pick the codec a connecting client asked for; JSON if none."""
+    query = parse_qs(scope.get("query_string", b"").decode())
+    wants_msgpack = (
+        MSGPACK_SUBPROTOCOL in scope.get("subprotocols", [])
+        or query.get("proto", [""])[0] == "msgpack"
+    )
+    if wants_msgpack:
+        try:
+            return MsgPackCodec()
+        except ImportError:
+            pass
+    return JSONCodec()
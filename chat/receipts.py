@@ -0,0 +1,47 @@
+import asyncio
+
+from django.conf import settings
+
+
+class ReadReceiptBatcher:
+    """
+    Per-connection coalescing of "read up to message X" frames.
+
+    Clients may report reads as often as they like; within `window` seconds
+    only the highest id per conversation is kept, and `on_flush(other_user,
+    conversation_id, up_to)` then runs once to apply it as a single range
+    UPDATE and one receipt broadcast. `up_to=None` means "everything so far".
+    """
+
+    def __init__(self, on_flush, window=None):
+        self.on_flush = on_flush
+        self.window = settings.CHAT_READ_RECEIPT_WINDOW if window is None else window
+        self._pending = {}
+        self._timer = None
+        self._flushing = None
+
+    def add(self, conversation_id, other_user, up_to=None):
+        if conversation_id in self._pending:
+            _, current = self._pending[conversation_id]
+            if current is None or up_to is None:
+                up_to = None
+            else:
+                up_to = max(current, up_to)
+        self._pending[conversation_id] = (other_user, up_to)
+
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.window, self._flush_later)
+
+    def _flush_later(self):
+        self._timer = None
+        self._flushing = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, {}
+        for conversation_id, (other_user, up_to) in pending.items():
+            await self.on_flush(other_user, conversation_id, up_to)
@@ -0,0 +1,188 @@
+import logging
+
+from django.db import DatabaseError, connection
+from django.db.models import Q
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGES = 50
+
+FTS_TABLE = "chat_message_fts"
+
+# SQLite: an external-content FTS5 table over chat_message.message, kept in
+# sync by triggers so bulk_create and raw writes are indexed too.
+SQLITE_INSTALL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(message, content='chat_message', content_rowid='id')
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON chat_message BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON chat_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF message ON chat_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message);
+    END
+    """,
+]
+SQLITE_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# PostgreSQL: a generated tsvector column maintained by the database itself
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE chat_message ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', message)) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS chat_message_search_gin
+    ON chat_message USING GIN (search_vector)
+    """,
+]
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS chat_message_search_gin",
+    "ALTER TABLE chat_message DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def fts5_available(conn=connection):
+    """Whether this SQLite build has FTS5, compiled in or loaded as an extension."""
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.chat_fts5_probe USING fts5(x)")
+        except DatabaseError:
+            return False
+        cursor.execute("DROP TABLE temp.chat_fts5_probe")
+    return True
+
+
+def install_index(conn=connection):
+    """
+    Create the full-text index for the current backend (idempotent).
+    Returns False if the backend has none, leaving search on LIKE.
+    """
+    statements = {"sqlite": SQLITE_INSTALL, "postgresql": POSTGRES_INSTALL}.get(conn.vendor, [])
+    if conn.vendor == "sqlite" and not fts5_available(conn):
+        logger.warning("SQLite has no FTS5; message search will use LIKE")
+        statements = []
+    with conn.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+    return bool(statements)
+
+
+def uninstall_index(conn=connection):
+    statements = {"sqlite": SQLITE_UNINSTALL, "postgresql": POSTGRES_UNINSTALL}.get(conn.vendor, [])
+    with conn.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def rebuild_index(conn=connection):
+    """Re-derive the index from chat_message (initial load or repair)."""
+    if not install_index(conn):
+        return
+    with conn.cursor() as cursor:
+        if conn.vendor == "sqlite":
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif conn.vendor == "postgresql":
+            cursor.execute("REINDEX INDEX chat_message_search_gin")
+
+
+def _fts5_query(text):
+    # Quote every word so user input can't inject FTS5 syntax; the trailing
+    # * makes the last word a prefix match for search-as-you-type
+    words = [w.replace('"', '""') for w in text.split()]
+    return " ".join(f'"{w}"' for w in words[:-1]) + (f' "{words[-1]}"*' if words else "")
+
+
+def _ranked_ids(user_id, text, other_user_id, limit, offset):
+    if other_user_id is None:
+        scope = "(m.sender_id = %s OR m.receiver_id = %s)"
+        scope_params = [user_id, user_id]
+    else:
+        scope = (
+            "((m.sender_id = %s AND m.receiver_id = %s) OR "
+            "(m.sender_id = %s AND m.receiver_id = %s))"
+        )
+        scope_params = [user_id, other_user_id, other_user_id, user_id]
+
+    if connection.vendor == "sqlite":
+        sql = f"""
+            SELECT m.id FROM {FTS_TABLE}
+            JOIN chat_message m ON m.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND {scope}
+            ORDER BY bm25({FTS_TABLE}), m.id DESC
+            LIMIT %s OFFSET %s
+        """
+        params = [_fts5_query(text), *scope_params, limit, offset]
+    elif connection.vendor == "postgresql":
+        sql = f"""
+            SELECT m.id FROM chat_message m, websearch_to_tsquery('simple', %s) q
+            WHERE m.search_vector @@ q AND {scope}
+            ORDER BY ts_rank(m.search_vector, q) DESC, m.id DESC
+            LIMIT %s OFFSET %s
+        """
+        params = [text, *scope_params, limit, offset]
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_messages(user, text, other_user=None, page=1, page_size=SEARCH_PAGE_SIZE):
+    """
+    Ranked full-text search over the messages `user` sent or received,
+    optionally only within the conversation with `other_user`.
+
+    Returns (messages, has_more).
+    """
+    text = text.strip()
+    if not text:
+        return [], False
+
+    offset = (page - 1) * page_size
+    other_user_id = other_user.id if other_user is not None else None
+
+    try:
+        ids = _ranked_ids(user.id, text, other_user_id, page_size + 1, offset)
+    except DatabaseError:
+        # Index not installed (e.g. SQLite built without FTS5)
+        logger.warning("Full-text search unavailable, falling back to LIKE", exc_info=True)
+        ids = None
+
+    if ids is None:
+        scope = Q(sender_id=user.id) | Q(receiver_id=user.id)
+        if other_user_id is not None:
+            scope = (
+                (Q(sender_id=user.id) & Q(receiver_id=other_user_id)) |
+                (Q(sender_id=other_user_id) & Q(receiver_id=user.id))
+            )
+        ids = list(
+            Message.objects.filter(scope, message__icontains=text)
+            .order_by("-timestamp", "-id")
+            .values_list("id", flat=True)[offset:offset + page_size + 1]
+        )
+
+    has_more = len(ids) > page_size
+    ids = ids[:page_size]
+    by_id = Message.objects.select_related("sender", "receiver").in_bulk(ids)
+    return [by_id[i] for i in ids if i in by_id], has_more
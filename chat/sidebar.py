@@ -0,0 +1,122 @@
+"""
+Per-user caching of the rendered chat sidebar.
+
+Fragments are keyed by the user's sidebar_version, a counter on the user
+row that is bumped whenever their sidebar would render differently: a
+message to or from them is saved, they read messages, or one of their
+contacts goes on- or offline. The request has already loaded the user row,
+so reading the version is free, and since it lives in the database every
+worker sees a bump at once, even with a process-local cache.
+"""
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models import F, Q
+
+from chat_app.metrics import registry
+
+# Conversations listed in the sidebar; everyone else is reached through
+# the user directory search
+SIDEBAR_CONVERSATIONS = 50
+
+
+def sidebar_conversations(user_id, limit=SIDEBAR_CONVERSATIONS):
+    """The user's most recent conversations, as the sidebar queries them."""
+    from .models import Conversation
+
+    return (
+        Conversation.involving(user_id)
+        .select_related("user_a", "user_b", "last_message")
+        .order_by(F("last_timestamp").desc(nulls_last=True))[:limit]
+    )
+
+
+def bump_versions(user_ids=None):
+    """Invalidate the cached sidebars of `user_ids` (of everyone if None)."""
+    users = get_user_model().objects.all()
+    if user_ids is not None:
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        users = users.filter(id__in=user_ids)
+    users.update(sidebar_version=F("sidebar_version") + 1)
+
+
+def bump_contacts(user_ids):
+    """Invalidate the sidebars that show any of `user_ids`."""
+    from .models import Conversation
+
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    contacts = set()
+    pairs = Conversation.objects.filter(
+        Q(user_a_id__in=user_ids) | Q(user_b_id__in=user_ids)
+    ).values_list("user_a_id", "user_b_id")
+    for a, b in pairs:
+        contacts.add(b if a in user_ids else a)
+        if b in user_ids:
+            contacts.add(a)
+    bump_versions(contacts)
+
+
+class SidebarCache:
+    """Rendered fragments in a Django cache, with hit/miss counts for this process."""
+
+    def __init__(self, backend_alias, ttl):
+        self.backend_alias = backend_alias
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[self.backend_alias]
+
+    @staticmethod
+    def key(user, name, vary):
+        parts = ":".join(str(value) for value in vary)
+        return f"chat:sidebar:{user.id}:{user.sidebar_version}:{name}:{parts}"
+
+    def get_or_render(self, user, name, vary, render):
+        if not self.ttl:
+            return render()
+
+        key = self.key(user, name, vary)
+        html = self.backend.get(key)
+        with self._lock:
+            if html is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if html is None:
+            html = render()
+            # Superseded versions are never asked for again and age out
+            self.backend.set(key, html, self.ttl)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+
+
+def get_sidebar_cache():
+    global _cache
+    if _cache is None:
+        _cache = SidebarCache(
+            backend_alias=settings.CHAT_SIDEBAR_CACHE_BACKEND,
+            ttl=settings.CHAT_SIDEBAR_CACHE_TTL,
+        )
+    return _cache
+
+
+registry.register_collector(
+    "chat_sidebar_cache", "Sidebar fragment cache lookups in this process: hits and misses.",
+    lambda: get_sidebar_cache().stats(),
+)
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .sidebar import bump_contacts, bump_versions
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_username(sender, instance, update_fields=None, **kwargs):
+    # Saves that can't touch the username (e.g. login's last_login) skip the lookup
+    if instance.pk is None or (update_fields is not None and "username" not in update_fields):
+        return
+    instance._saved_username = (
+        sender.objects.filter(pk=instance.pk).values_list("username", flat=True).first()
+    )
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def bump_sidebars_on_rename(sender, instance, **kwargs):
+    # Cached sidebars show the name and link to /chat/<username>/
+    old_username = instance.__dict__.pop("_saved_username", None)
+    if old_username is not None and old_username != instance.username:
+        bump_versions([instance.id])
+        bump_contacts([instance.id])
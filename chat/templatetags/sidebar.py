@@ -0,0 +1,38 @@
+from django import template
+
+from chat.sidebar import get_sidebar_cache
+
+register = template.Library()
+
+
+class SidebarFragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary = vary
+
+    def render(self, context):
+        return get_sidebar_cache().get_or_render(
+            context["user"],
+            self.name.resolve(context),
+            [value.resolve(context) for value in self.vary],
+            lambda: self.nodelist.render(context),
+        )
+
+
+@register.tag
+def sidebar_fragment(parser, token):
+    """
+    {% sidebar_fragment "name" [vary_on ...] %}...{% endsidebar_fragment %}
+
+    Caches the enclosed markup per user and sidebar_version (chat/sidebar.py),
+    plus whatever else it varies on, like the conversation that is open.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' needs a fragment name.")
+    nodelist = parser.parse(("endsidebar_fragment",))
+    parser.delete_first_token()
+    return SidebarFragmentNode(
+        nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]]
+    )
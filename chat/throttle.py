@@ -0,0 +1,88 @@
+import time
+import weakref
+
+from django.conf import settings
+
+
+def parse_limit(value):
+    """"rate/burst" (frames per second, bucket size) -> (rate, burst); "0" -> None."""
+    rate, _, burst = str(value).partition("/")
+    rate = float(rate)
+    if rate <= 0:
+        return None
+    return rate, float(burst) if burst else max(rate, 1.0)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= 1
+
+    def wait(self):
+        return max(1 - self.tokens, 0) / self.rate
+
+
+class _Buckets(dict):
+    """frame type -> TokenBucket (a dict subclass so it can be weakly referenced)."""
+
+
+def _limits():
+    return {
+        "chat_message": (settings.CHAT_SOCKET_MESSAGE_LIMIT, settings.CHAT_USER_MESSAGE_LIMIT),
+        "typing": (settings.CHAT_SOCKET_TYPING_LIMIT, settings.CHAT_USER_TYPING_LIMIT),
+    }
+
+
+def _buckets(limits):
+    buckets = _Buckets()
+    for frame_type, limit in limits.items():
+        limit = parse_limit(limit)
+        if limit is not None:
+            buckets[frame_type] = TokenBucket(*limit)
+    return buckets
+
+
+# A user's buckets live as long as one of their sockets in this process does
+_user_buckets = weakref.WeakValueDictionary()
+
+
+class FrameLimiter:
+    """Token buckets for one socket's inbound frames, plus its user's shared ones."""
+
+    def __init__(self, user_id):
+        limits = _limits()
+        self.socket = _buckets({frame_type: limit for frame_type, (limit, _) in limits.items()})
+        self.user = _user_buckets.get(user_id)
+        if self.user is None:
+            self.user = _user_buckets[user_id] = _buckets(
+                {frame_type: limit for frame_type, (_, limit) in limits.items()}
+            )
+
+    def check(self, frame_type):
+        """
+        None if the frame may go through, else (scope that refused it,
+        seconds until that bucket has a token again).
+        """
+        buckets = [
+            (scope, bucket)
+            for scope, bucket in (("socket", self.socket.get(frame_type)), ("user", self.user.get(frame_type)))
+            if bucket is not None
+        ]
+        # Every bucket must have a token before any is spent, so a frame
+        # the user bucket refuses doesn't cost the socket one as well
+        for scope, bucket in buckets:
+            if not bucket.refill():
+                return scope, bucket.wait()
+        for _, bucket in buckets:
+            bucket.tokens -= 1
+        return None
@@ -0,0 +1,33 @@
+import gzip
+import os
+import sys
+
+
+def open_jsonl(path, mode):
+    """
+    Text stream for a JSONL file, gzip-compressed when the name ends in
+    .gz; "-" is stdin/stdout. mode is "r" or "w".
+    """
+    if path == "-":
+        stream = sys.stdin if mode == "r" else sys.stdout
+        return open(stream.fileno(), mode, encoding="utf-8", closefd=False)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, offset):
+    # Written next to the old one and swapped in, so a crash never leaves
+    # a truncated checkpoint behind
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(offset))
+    os.replace(tmp, path)
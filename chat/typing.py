@@ -0,0 +1,101 @@
+import asyncio
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from chat_app.metrics import registry
+
+
+# Process-wide counters: frames received from clients vs. events fanned out
+TYPING_STATS = Counter()
+
+
+def typing_stats():
+    return {
+        "received": TYPING_STATS["received"],
+        "forwarded": TYPING_STATS["forwarded"],
+        "expired": TYPING_STATS["expired"],
+    }
+
+
+registry.register_collector(
+    "chat_typing_frames", "Typing frames received, forwarded and expired by this process.", typing_stats
+)
+
+
+class _TypingState:
+    __slots__ = ("last_forwarded", "expire_args", "timer")
+
+    def __init__(self, last_forwarded, expire_args):
+        self.last_forwarded = last_forwarded
+        self.expire_args = expire_args
+        self.timer = None
+
+
+class TypingTracker:
+    """
+    Per-connection typing state, one entry per conversation.
+
+    Clients send a typing frame on every keystroke; update() decides which
+    of them are worth a group_send: start/stop transitions always, "still
+    typing" at most once per `refresh_interval`. If the client goes quiet
+    for `timeout` seconds, `on_expire(*args)` is called to send the stop
+    event the client never sent.
+    """
+
+    def __init__(self, on_expire, refresh_interval=None, timeout=None):
+        self.on_expire = on_expire
+        self.refresh_interval = (
+            settings.CHAT_TYPING_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        )
+        self.timeout = settings.CHAT_TYPING_TIMEOUT if timeout is None else timeout
+        self._typing = {}
+        self._tasks = set()
+
+    def update(self, conversation_id, is_typing, *expire_args):
+        """Record a typing frame; return True if it should be forwarded."""
+        TYPING_STATS["received"] += 1
+        now = time.monotonic()
+        state = self._typing.get(conversation_id)
+
+        if not is_typing:
+            if state is None:
+                return False
+            state.timer.cancel()
+            del self._typing[conversation_id]
+            TYPING_STATS["forwarded"] += 1
+            return True
+
+        if state is None:
+            state = self._typing[conversation_id] = _TypingState(now, expire_args)
+            forward = True
+        else:
+            state.timer.cancel()
+            forward = now - state.last_forwarded >= self.refresh_interval
+
+        loop = asyncio.get_running_loop()
+        state.timer = loop.call_later(self.timeout, self._expire, conversation_id)
+
+        if forward:
+            state.last_forwarded = now
+            TYPING_STATS["forwarded"] += 1
+        return forward
+
+    def _expire(self, conversation_id):
+        state = self._typing.pop(conversation_id, None)
+        if state is None:
+            return
+        TYPING_STATS["expired"] += 1
+        TYPING_STATS["forwarded"] += 1
+        task = asyncio.ensure_future(self.on_expire(*state.expire_args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop_all(self):
+        """Connection closing: send a stop event for everything still typing."""
+        for conversation_id, state in list(self._typing.items()):
+            state.timer.cancel()
+            self._expire(conversation_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -3,5 +3,7 @@ from . import views
 
 urlpatterns = [
     path('', views.user_list, name='user_list'),
+    path('api/search/', views.message_search, name='message_search'),
     path('<str:username>/', views.chat_room, name='chat_room'),
+    path('<str:username>/history/', views.message_history, name='message_history'),
 ]
@@ -1,46 +1,128 @@
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from .models import Message
-from users.models import CustomUser
-from django.db.models import Q
+from django.http import Http404, JsonResponse
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import require_GET
+from .history import HISTORY_PAGE_SIZE, MAX_HISTORY_PAGE_SIZE, history_page
+from .models import Conversation
+from .search import MAX_SEARCH_PAGES, search_messages
+from .sidebar import sidebar_conversations
+from users.cache import user_cache
+from users.ws_auth import connection_token
+
+
+def sidebar_users(user):
+    # The user's most recent conversations in one query
+    users = []
+    for conversation in sidebar_conversations(user.id):
+        u = conversation.other_user(user)
+        u.last_message = conversation.last_message
+        u.unread_count = conversation.unread_for(user)
+        users.append(u)
+
+    return users
+
+def get_cached_user_or_404(username):
+    user = user_cache.get_by_username(username)
+    if user is None:
+        raise Http404("No such user.")
+    return user
 
 @login_required
 def user_list(request):
-    users = CustomUser.objects.exclude(id=request.user.id)
-    for u in users:
-        u.last_message = Message.objects.filter(
-            (Q(sender=request.user) & Q(receiver=u)) |
-            (Q(sender=u) & Q(receiver=request.user))
-        ).order_by('-timestamp').first()
-        u.unread_count = Message.objects.filter(sender=u, receiver=request.user, is_read=False).count()
+    # Only queried if a sidebar fragment isn't cached
+    users = SimpleLazyObject(lambda: sidebar_users(request.user))
     return render(request, 'user_list.html', {'users': users})
 
 @login_required
 def chat_room(request, username):
-    other_user = get_object_or_404(CustomUser, username=username)
+    other_user = get_cached_user_or_404(username)
     
-    # Load previous history
-    messages = Message.objects.filter(
-        (Q(sender=request.user) & Q(receiver=other_user)) |
-        (Q(sender=other_user) & Q(receiver=request.user))
-    ).order_by('timestamp')
+    # Load the newest page of history; older pages come from message_history
+    messages, history_cursor = history_page(request.user, other_user)
     
     # Mark messages as read
-    Message.objects.filter(sender=other_user, receiver=request.user, is_read=False).update(is_read=True)
+    conversation = Conversation.for_users(request.user.id, other_user.id)
+    Conversation.mark_read(request.user.id, other_user.id)
     
-    users = CustomUser.objects.exclude(id=request.user.id)
-    for u in users:
-        u.last_message = Message.objects.filter(
-            (Q(sender=request.user) & Q(receiver=u)) |
-            (Q(sender=u) & Q(receiver=request.user))
-        ).order_by('-timestamp').first()
-        u.unread_count = Message.objects.filter(sender=u, receiver=request.user, is_read=False).count()
+    users = SimpleLazyObject(lambda: sidebar_users(request.user))
 
     return render(request, 'chat.html', {
         'other_user': other_user,
+        'conversation_id': conversation.id,
         'chat_messages': messages,
+        'history_cursor': history_cursor,
+        'ws_token': connection_token(request.user),
+        # Where a reconnecting socket resumes from
+        'last_seq': max((m.seq or 0 for m in messages), default=0),
         'users': users
     })
 
+@login_required
+@require_GET
+def message_history(request, username):
+    other_user = get_cached_user_or_404(username)
+
+    try:
+        limit = min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), MAX_HISTORY_PAGE_SIZE)
+        messages, next_cursor = history_page(
+            request.user,
+            other_user,
+            cursor=request.GET.get('before'),
+            limit=max(limit, 1),
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor or limit.'}, status=400)
+
+    return JsonResponse({
+        'messages': [
+            {
+                'id': msg.id,
+                'message': msg.message,
+                'sender': msg.sender.username,
+                'timestamp': msg.timestamp.isoformat(),
+                'is_read': msg.is_read,
+            }
+            for msg in messages
+        ],
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+@require_GET
+def message_search(request):
+    other_user = None
+    if request.GET.get('with'):
+        other_user = get_cached_user_or_404(request.GET['with'])
+
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 0
+    if not 1 <= page <= MAX_SEARCH_PAGES:
+        return JsonResponse({'error': 'Invalid page.'}, status=400)
+
+    results, has_more = search_messages(
+        request.user,
+        request.GET.get('q', ''),
+        other_user=other_user,
+        page=page,
+    )
+
+    return JsonResponse({
+        'results': [
+            {
+                'id': msg.id,
+                'message': msg.message,
+                'sender': msg.sender.username,
+                'receiver': msg.receiver.username,
+                'timestamp': msg.timestamp.isoformat(),
+            }
+            for msg in results
+        ],
+        'page': page,
+        'has_more': has_more,
+    })
+
 def landing(request):
     return render(request, 'landing.html')
@@ -1,17 +1,17 @@
 import os
 import django
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chat_app.settings")
 django.setup()
 
 import chat.routing
+from users.ws_auth import WebsocketAuthStack
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "websocket": WebsocketAuthStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
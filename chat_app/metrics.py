@@ -0,0 +1,254 @@
+"""
+In-process metrics with a Prometheus text endpoint.
+
+Counters, gauges and histograms are plain dicts keyed by label values, so
+recording is a dict lookup and an add (a bisect for histograms). /metrics
+renders the current values; point Prometheus at every worker process.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+# Seconds; spans a cache hit to a slow page render
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self):
+        with self._lock:
+            return [(key, list(v) if isinstance(v, list) else v) for key, v in self._values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in self.snapshot()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # One slot per bucket plus +Inf, then the running sum
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = self.header()
+        for key, series in self.snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = _format_labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def register_collector(self, prefix, help, func):
+        """Export a stats() dict (e.g. the user cache's) as one gauge per key."""
+        self.collectors.append((prefix, help, func))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, help, func in self.collectors:
+            for key, value in func().items():
+                name = f"{prefix}_{key}"
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by view and status.", ("view", "status")
+)
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Time spent in the view and the middleware below it.", ("view",)
+)
+HTTP_QUERIES = registry.histogram(
+    "http_request_db_queries", "Database queries per request.", ("view",), QUERY_BUCKETS
+)
+
+# WebSocket
+WS_OPEN = registry.gauge("ws_open_sockets", "Currently accepted sockets.", ("consumer",))
+WS_HANDLER_LATENCY = registry.histogram(
+    "ws_handler_duration_seconds",
+    "Time spent in connect/receive/disconnect handlers.",
+    ("consumer", "handler"),
+)
+CHAT_MESSAGES = registry.counter(
+    "chat_messages_total", "Chat messages sent; use rate() for messages per second.", ("persistence",)
+)
+GROUP_SEND_LATENCY = registry.histogram(
+    "channel_layer_group_send_seconds", "Time for one channel_layer.group_send call."
+)
+FRAMES_THROTTLED = registry.counter(
+    "ws_frames_throttled_total", "Inbound frames refused by a rate limit.", ("frame", "scope")
+)
+OUTBOX_DROPPED = registry.counter(
+    "ws_outbox_dropped_total", "Ephemeral events dropped from a full outbound buffer.", ("event",)
+)
+SLOW_CLIENT_CLOSES = registry.counter(
+    "ws_slow_client_closes_total", "Sockets closed for falling too far behind.", ("consumer",)
+)
+CHANNEL_FULL_DROPS = registry.counter(
+    "channel_layer_full_drops_total", "Direct sends dropped because the recipient's channel was full."
+)
+DB_QUEUE_WAIT = registry.histogram(
+    "db_sync_to_async_wait_seconds",
+    "Time a database_sync_to_async call waited for its executor thread.",
+)
+
+# Mail
+MAIL_DELIVERY_LATENCY = registry.histogram(
+    "mail_delivery_seconds", "Time from queueing an email to the SMTP server accepting it.",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+
+
+
+def metrics_enabled():
+    return settings.METRICS_ENABLED
+
+
+class MetricsMiddleware:
+    """Request count, latency and query count per resolved view name."""
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        HTTP_REQUESTS.inc(view, response.status_code)
+        HTTP_LATENCY.observe(elapsed, view)
+        HTTP_QUERIES.observe(queries[0], view)
+        return response
+
+
+def _authorized(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        header = request.headers.get("Authorization", "")
+        if hmac.compare_digest(header, f"Bearer {token}"):
+            return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def metrics_view(request):
+    if not metrics_enabled():
+        raise Http404
+    if not _authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
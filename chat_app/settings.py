@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    "chat_app.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -87,6 +88,11 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Requests close their connection when they finish: under ASGI each
+        # one runs in a new thread, so a persistent connection would leak.
+        # Only the consumer DB threads keep theirs (CHAT_DB_CONN_MAX_AGE),
+        # checked before reuse.
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
@@ -99,6 +105,80 @@ CHANNEL_LAYERS = {
 }
 
 
+# "sync" saves each chat message before broadcasting it; "write_behind"
+# broadcasts first and batches the INSERTs (see chat/persistence.py).
+CHAT_PERSISTENCE = os.getenv("CHAT_PERSISTENCE", "sync")
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BEHIND_BATCH_SIZE", "100"))
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("CHAT_WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+
+# Presence: live-socket counts per user ("memory" or "redis"), see chat/presence.py
+CHAT_PRESENCE_BACKEND = os.getenv("CHAT_PRESENCE_BACKEND", "memory")
+CHAT_PRESENCE_REDIS_URL = os.getenv("CHAT_PRESENCE_REDIS_URL", "redis://localhost:6379/0")
+CHAT_PRESENCE_DEBOUNCE = float(os.getenv("CHAT_PRESENCE_DEBOUNCE", "5"))
+CHAT_PRESENCE_FLUSH_INTERVAL = float(os.getenv("CHAT_PRESENCE_FLUSH_INTERVAL", "2"))
+
+# Where 1:1 events go: "memory" or "redis" keep a registry of each user's
+# socket channel names and send to them directly (chat/delivery.py);
+# "none" always goes through the channel-layer groups. "memory" only works
+# with InMemoryChannelLayer and falls back to groups otherwise.
+CHAT_DELIVERY_REGISTRY = os.getenv("CHAT_DELIVERY_REGISTRY", "memory")
+CHAT_DELIVERY_REDIS_URL = os.getenv("CHAT_DELIVERY_REDIS_URL", CHAT_PRESENCE_REDIS_URL)
+
+# Typing indicators: forward "still typing" at most every REFRESH seconds,
+# and send an automatic stop after TIMEOUT seconds without a frame
+CHAT_TYPING_REFRESH_INTERVAL = float(os.getenv("CHAT_TYPING_REFRESH_INTERVAL", "3"))
+CHAT_TYPING_TIMEOUT = float(os.getenv("CHAT_TYPING_TIMEOUT", "6"))
+
+# Read receipts from one socket are coalesced for this many seconds and
+# applied as a single range UPDATE
+CHAT_READ_RECEIPT_WINDOW = float(os.getenv("CHAT_READ_RECEIPT_WINDOW", "0.5"))
+
+# `manage.py archive_messages` moves read messages older than this into
+# compressed per-conversation blocks (chat/archive.py)
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "180"))
+CHAT_ARCHIVE_BLOCK_SIZE = int(os.getenv("CHAT_ARCHIVE_BLOCK_SIZE", "500"))
+
+# Inbound rate limits as "rate/burst" token buckets (frames per second,
+# bucket size); "0" turns one off. Each socket has its own buckets and
+# shares a second set with the user's other sockets in this process.
+CHAT_SOCKET_MESSAGE_LIMIT = os.getenv("CHAT_SOCKET_MESSAGE_LIMIT", "5/20")
+CHAT_USER_MESSAGE_LIMIT = os.getenv("CHAT_USER_MESSAGE_LIMIT", "10/40")
+CHAT_SOCKET_TYPING_LIMIT = os.getenv("CHAT_SOCKET_TYPING_LIMIT", "5/10")
+CHAT_USER_TYPING_LIMIT = os.getenv("CHAT_USER_TYPING_LIMIT", "10/20")
+
+# Events waiting to be written to one socket. Typing and presence updates
+# are dropped when it is full; a socket with nothing left to drop is closed.
+CHAT_OUTBOX_LIMIT = int(os.getenv("CHAT_OUTBOX_LIMIT", "256"))
+# Frames sent to an acknowledging client (?ack=1) that it hasn't confirmed
+# yet; past this the socket's events wait in its outbox instead
+CHAT_SEND_WINDOW = int(os.getenv("CHAT_SEND_WINDOW", "64"))
+
+# Consumer database work runs on CHAT_DB_THREADS threads with one persistent
+# connection each (chat/db.py). SQLite allows one writer, so it gets one
+# thread unless told otherwise. Up to QUEUE_LIMIT further calls queue for a
+# thread; beyond that callers wait, and frames that waited QUEUE_TIMEOUT
+# seconds are rejected with a "busy" error.
+CHAT_DB_THREADS = int(os.getenv(
+    "CHAT_DB_THREADS", "1" if DATABASES["default"]["ENGINE"].endswith("sqlite3") else "8"
+))
+CHAT_DB_QUEUE_LIMIT = int(os.getenv("CHAT_DB_QUEUE_LIMIT", "200"))
+CHAT_DB_QUEUE_TIMEOUT = float(os.getenv("CHAT_DB_QUEUE_TIMEOUT", "2"))
+# Seconds each consumer DB thread keeps its connection open between calls
+CHAT_DB_CONN_MAX_AGE = int(os.getenv("CHAT_DB_CONN_MAX_AGE", "60"))
+
+# Rendered sidebar fragments (chat/sidebar.py) live in this CACHES alias for
+# up to TTL seconds; 0 renders them on every request. They are keyed by a
+# version on the user row, so a local-memory cache stays correct with
+# several workers, it just hits less often than a shared one.
+CHAT_SIDEBAR_CACHE_BACKEND = os.getenv("CHAT_SIDEBAR_CACHE_BACKEND", "default")
+CHAT_SIDEBAR_CACHE_TTL = int(os.getenv("CHAT_SIDEBAR_CACHE_TTL", "600"))
+
+# Prometheus metrics at /metrics (chat_app/metrics.py), readable by staff
+# users or with "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True") == "True"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -134,6 +214,25 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "users.CustomUser"
 
+# Process-local user cache (users/cache.py); set USER_CACHE_BACKEND to a
+# CACHES alias to share entries between workers as well
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND") or None
+
+# Lifetime of the signed token chat pages give their sockets so connects skip
+# the session and user queries (users/ws_auth.py); older sockets fall back to
+# the session cookie. Logout and password changes revoke tokens in every
+# worker within USER_CACHE_TTL, or at once with USER_CACHE_BACKEND set.
+WS_TOKEN_MAX_AGE = int(os.getenv("WS_TOKEN_MAX_AGE", "300"))
+
+# Initials avatars (users/avatars.py) are rendered on first request and kept
+# in AVATAR_CACHE_DIR; only AVATAR_SIZES (pixels) are served, so arbitrary
+# URLs can't fill the disk. `manage.py warm_avatars` renders them ahead.
+AVATAR_CACHE_DIR = Path(os.getenv("AVATAR_CACHE_DIR", BASE_DIR / "avatar_cache"))
+AVATAR_SIZES = [int(size) for size in os.getenv("AVATAR_SIZES", "64,128,256").split(",")]
+AVATAR_FORMAT = os.getenv("AVATAR_FORMAT", "webp")  # or "png"
+
 
 
 LOGIN_URL = "login"
@@ -150,6 +249,15 @@ EMAIL_HOST_USER = os.getenv("EMAIL_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_PASS")
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+# Don't let a stuck SMTP server hold the sender thread forever
+EMAIL_TIMEOUT = 10
+
+# Mail goes out from a per-process background thread (users/mail.py): one
+# SMTP connection per batch, failed messages retried after BACKOFF * 2**n
+# seconds up to MAX_ATTEMPTS times
+EMAIL_QUEUE_BATCH_SIZE = int(os.getenv("EMAIL_QUEUE_BATCH_SIZE", "50"))
+EMAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv("EMAIL_QUEUE_MAX_ATTEMPTS", "5"))
+EMAIL_QUEUE_RETRY_BACKOFF = float(os.getenv("EMAIL_QUEUE_RETRY_BACKOFF", "2"))
 
 
 
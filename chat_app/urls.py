@@ -2,10 +2,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
 from chat.views import landing
+from chat_app.metrics import metrics_view
 from users import views as user_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('users.urls')),
     path('chat/', include('chat.urls')),
     path('', landing, name='landing'),
@@ -0,0 +1,87 @@
+"""
+Initials avatars rendered locally with Pillow and cached on disk.
+
+An avatar depends only on (username, size, format) and RENDER_VERSION, so a
+hash of those names both its cache file and its ETag, and the URL can be
+cached by browsers indefinitely. Bump RENDER_VERSION when the drawing
+changes: it is part of the URL too, so clients fetch the new images.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageFont
+
+RENDER_VERSION = 1
+
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp"}
+
+# Backgrounds that keep white initials readable; picked by username hash
+PALETTE = (
+    "#7C3AED", "#4949F4", "#2563EB", "#0891B2", "#059669",
+    "#65A30D", "#D97706", "#DC2626", "#DB2777", "#9333EA",
+)
+
+
+def initials(username):
+    """"bob_jones" -> "BJ", "alice" -> "AL"."""
+    words = [word for word in re.split(r"[\W_]+", username) if word]
+    if len(words) >= 2:
+        return (words[0][0] + words[1][0]).upper()
+    return (words[0][:2] if words else username[:2] or "?").upper()
+
+
+def avatar_key(username, size, fmt):
+    return hashlib.sha256(f"{RENDER_VERSION}:{username}:{size}:{fmt}".encode()).hexdigest()[:32]
+
+
+def avatar_path(username, size, fmt):
+    key = avatar_key(username, size, fmt)
+    # Fan out so no single directory holds every user's files
+    return Path(settings.AVATAR_CACHE_DIR) / key[:2] / f"{key}.{fmt}"
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+def render_avatar(username, size, fmt):
+    digest = hashlib.sha256(username.encode()).digest()
+    image = Image.new("RGB", (size, size), PALETTE[digest[0] % len(PALETTE)])
+    draw = ImageDraw.Draw(image)
+
+    text = initials(username)
+    font = _font(int(size * 0.4))
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    draw.text(
+        ((size - (right - left)) / 2 - left, (size - (bottom - top)) / 2 - top),
+        text,
+        fill="#FFFFFF",
+        font=font,
+    )
+
+    out = io.BytesIO()
+    image.save(out, format=fmt.upper(), optimize=True)
+    return out.getvalue()
+
+
+def get_avatar(username, size, fmt):
+    """Path of the cached avatar, rendering and storing it first if needed."""
+    path = avatar_path(username, size, fmt)
+    if not path.exists():
+        data = render_avatar(username, size, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write under a temporary name so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return path
@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+
+from chat_app.metrics import registry
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """The slice of CustomUser the chat needs on its hot paths."""
+
+    id: int
+    username: str
+    is_online: bool
+
+    @property
+    def pk(self):
+        return self.id
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(id=user.id, username=user.username, is_online=user.is_online)
+
+
+class UserCache:
+    """
+    Two-level user lookup: a process-local LRU with a TTL in front of an
+    optional shared Django cache, in front of the database.
+
+    Records are stored by id; usernames only map to an id, and a username
+    hit is checked against the record, so a rename can never serve the
+    old account under the new name.
+    """
+
+    def __init__(self, max_size, ttl, backend_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend_alias = backend_alias
+        self._by_id = OrderedDict()
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    @property
+    def backend(self):
+        return caches[self.backend_alias] if self.backend_alias else None
+
+    @staticmethod
+    def _id_key(user_id):
+        return f"users:cache:id:{user_id}"
+
+    @staticmethod
+    def _username_key(username):
+        return f"users:cache:username:{username}"
+
+    def get_by_id(self, user_id):
+        record = self._get_local(user_id) or self._get_shared(user_id)
+        if record is None:
+            self._stats["misses"] += 1
+            record = self._load(id=user_id)
+        return record
+
+    def get_by_username(self, username):
+        user_id = self._ids.get(username)
+        if user_id is None and self.backend is not None:
+            user_id = self.backend.get(self._username_key(username))
+
+        if user_id is not None:
+            record = self._get_local(user_id) or self._get_shared(user_id)
+            if record is not None and record.username == username:
+                return record
+
+        self._stats["misses"] += 1
+        return self._load(username=username)
+
+    def _get_local(self, user_id):
+        with self._lock:
+            entry = self._by_id.get(user_id)
+            if entry is None:
+                return None
+            record, expires = entry
+            if expires < time.monotonic():
+                del self._by_id[user_id]
+                self._ids.pop(record.username, None)
+                return None
+            self._by_id.move_to_end(user_id)
+        self._stats["local_hits"] += 1
+        return record
+
+    def _get_shared(self, user_id):
+        if self.backend is None:
+            return None
+        record = self.backend.get(self._id_key(user_id))
+        if record is not None:
+            self._stats["shared_hits"] += 1
+            self._store_local(record)
+        return record
+
+    def _load(self, **lookup):
+        from .models import CustomUser
+
+        user = CustomUser.objects.filter(**lookup).only("id", "username", "is_online").first()
+        if user is None:
+            return None
+        record = CachedUser.from_user(user)
+        self.set(record)
+        return record
+
+    def _store_local(self, record):
+        with self._lock:
+            self._by_id[record.id] = (record, time.monotonic() + self.ttl)
+            self._by_id.move_to_end(record.id)
+            self._ids[record.username] = record.id
+            while len(self._by_id) > self.max_size:
+                evicted, _ = self._by_id.popitem(last=False)[1]
+                self._ids.pop(evicted.username, None)
+                self._stats["evictions"] += 1
+
+    def set(self, record):
+        self._store_local(record)
+        if self.backend is not None:
+            self.backend.set_many(
+                {
+                    self._id_key(record.id): record,
+                    self._username_key(record.username): record.id,
+                },
+                timeout=self.ttl,
+            )
+
+    def invalidate(self, user_id):
+        with self._lock:
+            entry = self._by_id.pop(user_id, None)
+            if entry is not None:
+                self._ids.pop(entry[0].username, None)
+        if self.backend is not None:
+            self.backend.delete(self._id_key(user_id))
+        self._stats["invalidations"] += 1
+
+    def invalidate_many(self, user_ids):
+        for user_id in user_ids:
+            self.invalidate(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._ids.clear()
+
+    def stats(self):
+        lookups = sum(self._stats[k] for k in ("local_hits", "shared_hits", "misses"))
+        hits = self._stats["local_hits"] + self._stats["shared_hits"]
+        return {
+            "size": len(self._by_id),
+            "max_size": self.max_size,
+            "local_hits": self._stats["local_hits"],
+            "shared_hits": self._stats["shared_hits"],
+            "misses": self._stats["misses"],
+            "evictions": self._stats["evictions"],
+            "invalidations": self._stats["invalidations"],
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+user_cache = UserCache(
+    max_size=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL,
+    backend_alias=settings.USER_CACHE_BACKEND,
+)
+
+registry.register_collector("user_cache", "User cache size, hit and miss counters.", user_cache.stats)
@@ -0,0 +1,182 @@
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from chat_app.metrics import MAIL_DELIVERY_LATENCY, metrics_enabled, registry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(order=True)
+class QueuedMail:
+    due: float
+    seq: int
+    message: EmailMessage = field(compare=False)
+    enqueued: float = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class MailQueue:
+    """
+    Per-process outbound mail queue with one background sender thread.
+
+    Requests only enqueue. The thread sends whatever is due over a single
+    SMTP connection per batch of up to `batch_size` messages, and puts a
+    failed message back with exponential backoff (`retry_backoff` * 2**n
+    seconds) until it has been tried `max_attempts` times.
+    """
+
+    def __init__(self, batch_size, max_attempts, retry_backoff):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._busy = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        atexit.register(self.flush_sync)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap) + self._busy
+
+    def enqueue(self, message):
+        now = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._heap, QueuedMail(now, next(self._counter), message, now))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mail-queue", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _take_due(self):
+        """Block until something is due; returns up to batch_size due items."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0].due <= now:
+                    batch = []
+                    while self._heap and self._heap[0].due <= now and len(batch) < self.batch_size:
+                        batch.append(heapq.heappop(self._heap))
+                    self._busy = len(batch)
+                    return batch
+                self._cond.wait(self._heap[0].due - now if self._heap else None)
+
+    def _run(self):
+        while True:
+            batch = self._take_due()
+            try:
+                self._send(batch)
+            except Exception:
+                logger.exception("Mail queue batch of %d failed", len(batch))
+            finally:
+                with self._cond:
+                    self._busy = 0
+                    self._cond.notify_all()
+
+    def _send(self, batch):
+        connection = get_connection()
+        pending = list(batch)
+        try:
+            connection.open()
+            while pending:
+                item = pending.pop(0)
+                try:
+                    connection.send_messages([item.message])
+                except Exception:
+                    logger.warning("Sending mail to %s failed", item.message.to, exc_info=True)
+                    self._retry(item)
+                    # The connection may be unusable now; the rest of the
+                    # batch gets a fresh one
+                    connection.close()
+                    connection.open()
+                else:
+                    self.sent += 1
+                    if metrics_enabled():
+                        MAIL_DELIVERY_LATENCY.observe(time.monotonic() - item.enqueued)
+        except Exception:
+            logger.warning("Could not connect to the mail server", exc_info=True)
+            for item in pending:
+                self._retry(item)
+        finally:
+            connection.close()
+
+    def _retry(self, item):
+        item.attempts += 1
+        if item.attempts >= self.max_attempts:
+            self.failed += 1
+            logger.error("Giving up on mail to %s after %d attempts", item.message.to, item.attempts)
+            return
+
+        self.retried += 1
+        item.due = time.monotonic() + self.retry_backoff * 2 ** (item.attempts - 1)
+        with self._cond:
+            heapq.heappush(self._heap, item)
+            self._cond.notify()
+
+    def join(self, timeout=None):
+        """Wait until nothing is queued or being sent; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._heap or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def flush_sync(self):
+        # Interpreter shutdown: the daemon thread dies with us, so try once
+        # more to send what is due now rather than lose it
+        with self._cond:
+            if self._busy:
+                self._cond.wait(5)
+            batch, self._heap = self._heap, []
+        if batch:
+            self._send(batch)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._heap),
+                "sending": self._busy,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+            }
+
+
+_queue = None
+
+
+def get_mail_queue():
+    global _queue
+    if _queue is None:
+        _queue = MailQueue(
+            batch_size=settings.EMAIL_QUEUE_BATCH_SIZE,
+            max_attempts=settings.EMAIL_QUEUE_MAX_ATTEMPTS,
+            retry_backoff=settings.EMAIL_QUEUE_RETRY_BACKOFF,
+        )
+    return _queue
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    """send_mail() that returns as soon as the message is queued."""
+    get_mail_queue().enqueue(EmailMessage(subject, message, from_email, recipient_list))
+
+
+registry.register_collector(
+    "mail_queue", "Outbound mail queue: queued, sending, and sent/retried/failed counters.",
+    lambda: get_mail_queue().stats(),
+)
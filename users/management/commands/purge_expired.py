@@ -0,0 +1,77 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from users.models import PasswordResetCode
+
+
+def delete_in_batches(queryset, batch_size, pause=0):
+    """
+    Delete the rows of `queryset` by primary key, `batch_size` at a time,
+    so no single statement holds its locks for long. Returns the count.
+    """
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by().values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += queryset.model.objects.filter(pk__in=pks).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete used or expired password reset codes and expired sessions in "
+        "small batches. Safe to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only",
+            choices=["codes", "sessions"],
+            help="Purge just one kind of row.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per DELETE.")
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="Seconds to sleep between batches, to leave room for other writers.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        if options["only"] in (None, "codes"):
+            self.purge("password reset codes", PasswordResetCode.expired(), options)
+
+        if options["only"] in (None, "sessions"):
+            store = import_module(settings.SESSION_ENGINE).SessionStore
+            if issubclass(store, DBSessionStore) and store.get_model_class() is Session:
+                self.purge(
+                    "expired sessions",
+                    Session.objects.filter(expire_date__lt=timezone.now()),
+                    options,
+                )
+            else:
+                # Cache or cookie sessions: let the backend expire them
+                start = time.perf_counter()
+                store.clear_expired()
+                self.stdout.write(self.style.SUCCESS(
+                    f"Cleared expired sessions via {settings.SESSION_ENGINE} "
+                    f"in {time.perf_counter() - start:.2f}s."
+                ))
+
+    def purge(self, label, queryset, options):
+        start = time.perf_counter()
+        deleted = delete_in_batches(queryset, options["batch_size"], options["pause"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} {label} in {time.perf_counter() - start:.2f}s."
+        ))
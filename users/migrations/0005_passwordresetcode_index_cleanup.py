@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_customuser_lower_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='passwordresetcode',
+            name='code',
+            field=models.CharField(max_length=6),
+        ),
+        migrations.AlterField(
+            model_name='passwordresetcode',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='passwordresetcode',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reset_codes', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_passwordresetcode_index_cleanup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='sidebar_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
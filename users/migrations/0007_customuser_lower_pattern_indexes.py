@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# PostgreSQL only: with a locale collation the plain Lower() btree indexes
+# can't serve LIKE 'prefix%', so the directory search gets pattern-ops
+# twins. lower() returns text, hence text_pattern_ops. SQLite range-scans
+# the Lower() indexes directly (users.views._prefix_q).
+PATTERN_INDEXES = {
+    'users_username_lower_pattern_idx': 'username',
+    'users_email_lower_pattern_idx': 'email',
+}
+
+
+def install(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, column in PATTERN_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} '
+            f'ON users_customuser (LOWER({column}) text_pattern_ops)'
+        )
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in PATTERN_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_customuser_sidebar_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
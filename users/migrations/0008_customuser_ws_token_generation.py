@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_customuser_lower_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='ws_token_generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils import timezone
 import datetime
 import random
@@ -8,11 +9,18 @@ class CustomUser(AbstractUser):
     email = models.EmailField(unique=True)
     is_online = models.BooleanField(default=False)
     last_seen = models.DateTimeField(auto_now=True)
+    # Bumped by the chat app whenever this user's sidebar would render
+    # differently; it keys the cached sidebar fragments (chat/sidebar.py)
+    sidebar_version = models.PositiveBigIntegerField(default=0)
+    # Bumped on logout and password change; signed into every WebSocket
+    # connection token, so older tokens stop matching (users/ws_auth.py)
+    ws_token_generation = models.PositiveIntegerField(default=0)
 
     class Meta:
         indexes = [
-            models.Index(fields=["email"]),
-            models.Index(fields=["username"]),
+            # Case-insensitive prefix search in the user directory
+            models.Index(Lower("email"), name="users_email_lower_idx"),
+            models.Index(Lower("username"), name="users_username_lower_idx"),
         ]
 
     def __str__(self):
@@ -24,23 +32,55 @@ class PasswordResetCode(models.Model):
     user = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
-        related_name="reset_codes"
+        related_name="reset_codes",
+        # Covered by the (user, code) index
+        db_index=False,
     )
-    code = models.CharField(max_length=6, db_index=True)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    code = models.CharField(max_length=6)
+    created_at = models.DateTimeField(auto_now_add=True)
     is_used = models.BooleanField(default=False)
 
+    VALID_FOR = datetime.timedelta(minutes=10)
+
     class Meta:
         ordering = ["-created_at"]
         indexes = [
+            # Verification looks codes up per user
             models.Index(fields=["user", "code"]),
+            # The janitor deletes by age
             models.Index(fields=["created_at"]),
         ]
 
     def is_valid(self):
-        expiry = self.created_at + datetime.timedelta(minutes=10)
+        expiry = self.created_at + self.VALID_FOR
         return not self.is_used and timezone.now() < expiry
 
+    @classmethod
+    def redeem(cls, user_id, code):
+        """
+        Use up the user's newest unexpired, unused `code`. Returns False if
+        there is none, or if a concurrent request redeemed it first.
+        """
+        pk = (
+            cls.objects.filter(
+                user_id=user_id,
+                code=code,
+                is_used=False,
+                created_at__gte=timezone.now() - cls.VALID_FOR,
+            )
+            .order_by("-created_at")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        return pk is not None and cls.objects.filter(pk=pk, is_used=False).update(is_used=True) == 1
+
+    @classmethod
+    def expired(cls):
+        """Codes that can no longer be redeemed."""
+        return cls.objects.filter(
+            models.Q(created_at__lt=timezone.now() - cls.VALID_FOR) | models.Q(is_used=True)
+        )
+
 
     @staticmethod
     def generate_code():
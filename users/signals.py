@@ -0,0 +1,29 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import user_cache
+from .models import CustomUser
+from .ws_auth import connection_auth
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.id)
+    connection_auth.invalidate(instance.id)
+
+
+@receiver(post_save, sender=CustomUser)
+def revoke_tokens_on_password_change(sender, instance, created, **kwargs):
+    # set_password() leaves the raw password in _password until save()
+    # finishes. Other workers still cache the old auth hash, so the
+    # change is revoked like a logout; a new user has no tokens yet.
+    if not created and getattr(instance, "_password", None) is not None:
+        connection_auth.revoke(instance)
+
+
+@receiver(user_logged_out)
+def revoke_connection_tokens(sender, request, user, **kwargs):
+    if user is not None:
+        connection_auth.revoke(user)
@@ -0,0 +1,14 @@
+from django import template
+from django.conf import settings
+from django.urls import reverse
+
+from users.avatars import RENDER_VERSION
+
+register = template.Library()
+
+
+@register.filter
+def avatar_url(username, size=64):
+    """{{ user.username|avatar_url:128 }} -> the locally rendered initials avatar."""
+    url = reverse("avatar", args=[username, int(size), settings.AVATAR_FORMAT])
+    return f"{url}?v={RENDER_VERSION}"
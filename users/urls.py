@@ -7,4 +7,6 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('profile/', views.profile_view, name='profile'),
     path('profile/edit/', views.edit_profile_view, name='edit_profile'),
+    path('directory/', views.user_directory_view, name='user_directory'),
+    path('avatars/<str:username>/<int:size>.<str:fmt>', views.avatar_view, name='avatar'),
 ]
@@ -1,12 +1,23 @@
+import sys
+
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout, authenticate, update_session_auth_hash
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.mail import send_mail
 from django.conf import settings
-from django.utils import timezone
-
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.http import FileResponse, Http404, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+
+from .avatars import CONTENT_TYPES, avatar_key, avatar_path, get_avatar
+from .cache import user_cache
+from .mail import queue_mail
 from .models import CustomUser, PasswordResetCode
 from .forms import (
     CustomUserCreationForm,
@@ -78,10 +89,12 @@ def password_reset_otp_view(request):
                     f"This code is valid for 10 minutes."
                 )
 
-                send_mail(subject, message, settings.EMAIL_HOST_USER, [email])
+                # Queued; the request doesn't wait on the SMTP server
+                queue_mail(subject, message, settings.EMAIL_HOST_USER, [email])
 
-                # Store email in session
+                # Store email in session; the id keys the code lookup
                 request.session["reset_email"] = email
+                request.session["reset_user_id"] = user.id
 
                 messages.success(
                     request,
@@ -104,8 +117,9 @@ def password_reset_otp_view(request):
 
 def password_reset_verify_view(request):
     email = request.session.get("reset_email")
+    user_id = request.session.get("reset_user_id")
 
-    if not email:
+    if not email or not user_id:
         return redirect("password_reset")
 
     if request.method == "POST":
@@ -114,22 +128,9 @@ def password_reset_verify_view(request):
         if form.is_valid():
             code = form.cleaned_data["code"]
 
-            reset_code = (
-                PasswordResetCode.objects.filter(
-                    user__email=email,
-                    code=code,
-                    is_used=False,
-                )
-                .order_by("-created_at")
-                .first()
-            )
-
-            if reset_code and reset_code.is_valid():
-                reset_code.is_used = True
-                reset_code.save()
-
+            if PasswordResetCode.redeem(user_id, code):
                 request.session["otp_verified"] = True
-                return redirect("password_reset_confirm")
+                return redirect("password_reset_confirm_otp")
 
             else:
                 messages.error(request, "Invalid or expired code.")
@@ -164,6 +165,7 @@ def password_reset_confirm_view(request):
 
             # Clear session
             del request.session["reset_email"]
+            request.session.pop("reset_user_id", None)
             del request.session["otp_verified"]
 
             messages.success(
@@ -195,6 +197,8 @@ def edit_profile_view(request):
 
         if form.is_valid():
             form.save()
+            # Renames must never be served from the user cache
+            user_cache.invalidate(request.user.id)
             messages.success(
                 request,
                 "Your profile has been updated successfully!"
@@ -208,4 +212,104 @@ def edit_profile_view(request):
         request,
         "users/edit_profile.html",
         {"form": form}
-    )
\ No newline at end of file
+    )
+
+
+DIRECTORY_PAGE_SIZE = 20
+
+
+def _prefix_range(prefix):
+    """
+    The [low, high) code-point range of strings starting with `prefix`;
+    high is None when no string sorts after them.
+    """
+    # Trailing U+10FFFF can't be incremented; the range widens to the
+    # shorter prefix's, which startswith narrows again
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return prefix, None
+    last = ord(stem[-1]) + 1
+    if 0xD800 <= last <= 0xDFFF:
+        # Surrogates can't be encoded; U+E000 is the next valid code point
+        last = 0xE000
+    return prefix, stem[:-1] + chr(last)
+
+
+def _prefix_q(field, prefix):
+    q = Q(**{f"{field}__startswith": prefix})
+    # On SQLite the range lets the planner scan the Lower() index, which
+    # startswith's LIKE can't use. It relies on code-point order, which
+    # SQLite's default BINARY collation has but a locale-aware collation
+    # (the PostgreSQL default) doesn't, so other backends keep startswith:
+    # PostgreSQL serves its LIKE 'prefix%' from the text_pattern_ops
+    # indexes of users migration 0007.
+    if connection.vendor == "sqlite":
+        low, high = _prefix_range(prefix)
+        q &= Q(**{f"{field}__gte": low})
+        if high is not None:
+            q &= Q(**{f"{field}__lt": high})
+    return q
+
+
+@login_required
+@require_GET
+def user_directory_view(request):
+    query = request.GET.get("q", "").strip().lower()
+    cursor = request.GET.get("after", "")
+
+    users = (
+        CustomUser.objects.exclude(id=request.user.id)
+        .annotate(username_lower=Lower("username"), email_lower=Lower("email"))
+        .only("id", "username", "is_online")
+    )
+
+    if query:
+        users = users.filter(_prefix_q("username_lower", query) | _prefix_q("email_lower", query))
+
+    # Keyset pagination on (lowercased username, username)
+    if cursor:
+        users = users.filter(
+            Q(username_lower__gt=cursor.lower()) |
+            Q(username_lower=cursor.lower(), username__gt=cursor)
+        )
+
+    page = list(users.order_by("username_lower", "username")[:DIRECTORY_PAGE_SIZE + 1])
+    has_more = len(page) > DIRECTORY_PAGE_SIZE
+    page = page[:DIRECTORY_PAGE_SIZE]
+
+    return JsonResponse({
+        "results": [
+            {
+                "username": u.username,
+                "is_online": u.is_online,
+                "url": reverse("chat_room", args=[u.username]),
+            }
+            for u in page
+        ],
+        "next_cursor": page[-1].username if has_more else None,
+    })
+
+
+AVATAR_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@require_GET
+def avatar_view(request, username, size, fmt):
+    if size not in settings.AVATAR_SIZES or fmt not in CONTENT_TYPES:
+        raise Http404("No such avatar.")
+
+    etag = quote_etag(avatar_key(username, size, fmt))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        path = avatar_path(username, size, fmt)
+        # Only render for real users; cached files skip the lookup
+        if not path.exists():
+            if user_cache.get_by_username(username) is None:
+                raise Http404("No such user.")
+            path = get_avatar(username, size, fmt)
+        response = FileResponse(open(path, "rb"), content_type=CONTENT_TYPES[fmt])
+        response.headers["ETag"] = etag
+
+    # The URL names exactly one rendering, so browsers never need to revalidate
+    patch_cache_control(response, public=True, max_age=AVATAR_MAX_AGE, immutable=True)
+    return response
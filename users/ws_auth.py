@@ -0,0 +1,172 @@
+"""
+Fast WebSocket authentication from a signed connection token.
+
+Pages that open sockets embed a short-lived token (connection_token) and
+pass it as ?token=. The socket then authenticates without the two queries
+AuthMiddlewareStack makes (session row, then user row): the token is
+checked by signature, and the user comes from a small in-process cache.
+A missing, expired or revoked token falls back to the session cookie.
+
+Revocation: logging out or changing the password bumps the user's
+ws_token_generation, which is signed into every token along with the
+session auth hash, so older tokens stop matching. Another worker notices
+once its cached copy of the user expires (USER_CACHE_TTL), or at once when
+USER_CACHE_BACKEND shares revocation marks between workers.
+"""
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+TOKEN_SALT = "users.ws_auth.connection_token"
+
+
+def _auth_tag(user):
+    # Changes with the password (the session's auth hash) and on every revoke
+    value = f"{user.get_session_auth_hash()}:{user.ws_token_generation}"
+    return salted_hmac(TOKEN_SALT, value).hexdigest()[:16]
+
+
+class ConnectionAuth:
+    """
+    Token minting and checking, plus a TTL'd LRU of full user instances.
+
+    Revocations bump the user row and are marked locally and, with
+    `backend_alias`, in a shared Django cache so other workers refuse old
+    tokens without waiting for their cached user to expire; users cached
+    before a revocation are reloaded.
+    """
+
+    def __init__(self, max_age, max_size, ttl, backend_alias=None):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend_alias = backend_alias
+        self._users = OrderedDict()
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.backend_alias] if self.backend_alias else None
+
+    @staticmethod
+    def _revoked_key(user_id):
+        return f"users:ws_auth:revoked:{user_id}"
+
+    def token_for(self, user):
+        return signing.dumps(
+            {"u": user.id, "t": time.time(), "h": _auth_tag(user)}, salt=TOKEN_SALT
+        )
+
+    def revoke(self, user):
+        """Refuse every token `user` holds; `user` is updated to mint new ones."""
+        from .models import CustomUser
+
+        # The row is what every worker checks tokens against; the marks
+        # below only make the revocation immediate instead of waiting for
+        # cached copies of the user to expire
+        user_id = user.id
+        CustomUser.objects.filter(id=user_id).update(ws_token_generation=F("ws_token_generation") + 1)
+        user.refresh_from_db(fields=["ws_token_generation"])
+
+        now = time.time()
+        with self._lock:
+            self._revoked[user_id] = now
+            self._users.pop(user_id, None)
+            # Marks older than max_age can't match a live token any more
+            for stale in [u for u, at in self._revoked.items() if at < now - self.max_age]:
+                del self._revoked[stale]
+        if self.backend is not None:
+            # Tokens older than max_age are dead anyway
+            self.backend.set(self._revoked_key(user_id), now, timeout=self.max_age)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _revoked_at(self, user_id):
+        with self._lock:
+            revoked = self._revoked.get(user_id)
+        if revoked is None and self.backend is not None:
+            revoked = self.backend.get(self._revoked_key(user_id))
+        return revoked
+
+    def _get_user(self, user_id, loaded_after=None):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                user, expires, loaded = entry
+                if expires >= time.monotonic() and (loaded_after is None or loaded > loaded_after):
+                    self._users.move_to_end(user_id)
+                    return user
+                del self._users[user_id]
+
+        from .models import CustomUser
+
+        loaded = time.time()
+        user = CustomUser.objects.filter(id=user_id, is_active=True).first()
+        if user is not None:
+            with self._lock:
+                self._users[user_id] = (user, time.monotonic() + self.ttl, loaded)
+                while len(self._users) > self.max_size:
+                    self._users.popitem(last=False)
+        return user
+
+    def authenticate(self, token):
+        """The token's user, or None if it is invalid, expired or revoked."""
+        try:
+            payload = signing.loads(token, salt=TOKEN_SALT, max_age=self.max_age)
+        except signing.BadSignature:
+            return None
+
+        revoked = self._revoked_at(payload["u"])
+        if revoked is not None and payload["t"] <= revoked:
+            return None
+
+        # A copy cached before the revocation may carry the old password
+        user = self._get_user(payload["u"], loaded_after=revoked)
+        if user is None or not constant_time_compare(payload["h"], _auth_tag(user)):
+            return None
+        return user
+
+
+connection_auth = ConnectionAuth(
+    max_age=settings.WS_TOKEN_MAX_AGE,
+    max_size=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL,
+    backend_alias=settings.USER_CACHE_BACKEND,
+)
+
+
+def connection_token(user):
+    return connection_auth.token_for(user)
+
+
+class ConnectionTokenMiddleware:
+    """Authenticates ?token= sockets; everything else goes through `fallback`."""
+
+    def __init__(self, inner, fallback):
+        self.inner = inner
+        self.fallback = fallback
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get("query_string", b"").decode()).get("token", [None])[0]
+        if token:
+            user = await database_sync_to_async(connection_auth.authenticate)(token)
+            if user is not None:
+                return await self.inner(dict(scope, user=user), receive, send)
+        return await self.fallback(scope, receive, send)
+
+
+def WebsocketAuthStack(inner):
+    """Drop-in for AuthMiddlewareStack with the connection-token fast path."""
+    return ConnectionTokenMiddleware(inner, fallback=AuthMiddlewareStack(inner))